@@ -1,4 +1,6 @@
+import asyncio
 import os
+import threading
 from contextlib import asynccontextmanager
 from logging import DEBUG
 from logging import getLogger
@@ -11,22 +13,54 @@ from app.routes import router as health_router
 from app.routes.inference import router as inference_router
 from app.routes.models import router as model_router
 from app.routes.models import session_router as model_session_router
-from app.state import MODEL_REGISTRY
+from app.state import CAPACITY_TRACKER, EMBEDDING_PREFETCHER, MODEL_REGISTRY
 from models.register_models import register_models
+from paths import STARTUP_REGISTRATION_ATTEMPTS, STARTUP_REGISTRATION_BACKOFF_S
 
 logger = getLogger(__name__)
 logger.setLevel(DEBUG)
 
 
+def _register_models_in_background(stop: threading.Event, attempts: int = STARTUP_REGISTRATION_ATTEMPTS,
+                                   backoff_s: float = STARTUP_REGISTRATION_BACKOFF_S):
+    """ Register the models and mark the service as ready. Runs in a worker thread, so that the service can already
+    answer liveness and readiness probes while registration is still running. Failed attempts, e.g. because the
+    registry is not reachable yet, are retried with exponential backoff. If all attempts fail, the error is kept in
+    the capacity tracker and /health reports the service as unhealthy, so that the orchestrator restarts it. """
+    try:
+        for attempt in range(1, attempts + 1):
+            logger.debug(f"Registering models in the MODEL_REGISTRY, attempt {attempt}/{attempts}")
+            try:
+                register_models(MODEL_REGISTRY)
+                CAPACITY_TRACKER.startup_error = None
+                return
+            except Exception as e:
+                CAPACITY_TRACKER.startup_error = f"Attempt {attempt}/{attempts} failed: {e}"
+                if attempt == attempts:
+                    logger.error(f"Model registration failed, the service will not become ready: {e}")
+                    return
+                delay = backoff_s * 2 ** (attempt - 1)
+                logger.warning(f"Model registration failed, retrying in {delay:.0f}s: {e}")
+                if stop.wait(delay):
+                    return
+    finally:
+        CAPACITY_TRACKER.startup_complete.set()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup code
     logger.debug("Starting up the Prompted Segmentation Service")
-    logger.debug("Registering models in the MODEL_REGISTRY")
-    register_models(MODEL_REGISTRY)
+    stop_registration = threading.Event()
+    registration = asyncio.create_task(asyncio.to_thread(_register_models_in_background, stop_registration))
     yield
     # Shutdown code
     logger.debug("Shutting down the Prompted Segmentation Service")
+    EMBEDDING_PREFETCHER.shutdown()
+    stop_registration.set()
+    if not registration.done():
+        logger.debug("Waiting for model registration to finish before shutting down")
+        await registration
 
 
 def create_app():
@@ -0,0 +1,131 @@
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from dataclasses import dataclass
+from logging import getLogger
+
+from models.embedding_cache import EMBEDDING_CACHE
+from paths import MAX_CONCURRENT_INFERENCES_PER_MODEL
+from util.memory import device_memory_info
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class ModelLoad:
+    """ Load statistics of a single model. """
+    queued: int = 0
+    in_flight: int = 0
+    completed: int = 0
+    avg_latency_s: float | None = None
+
+
+class CapacityTracker:
+    """ Tracks startup state, resident models and per-model load of this replica.
+
+    Inference calls of the same model are limited to MAX_CONCURRENT_INFERENCES_PER_MODEL at a time, requests
+    beyond that wait in a queue. The average latency is an exponential moving average over completed requests.
+    """
+    def __init__(self, max_concurrency: int = MAX_CONCURRENT_INFERENCES_PER_MODEL, latency_smoothing: float = 0.2):
+        self.max_concurrency = max_concurrency
+        self.latency_smoothing = latency_smoothing
+        self.startup_complete = threading.Event()
+        self.startup_error: str | None = None
+        self._loads: dict[str, ModelLoad] = {}
+        self._semaphores: dict[str, threading.Semaphore] = {}
+        self._resident = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.startup_complete.is_set() and self.startup_error is None
+
+    @property
+    def startup_failed(self) -> bool:
+        """ Startup finished with an error, e.g. model registration failed after all retries. """
+        return self.startup_complete.is_set() and self.startup_error is not None
+
+    def mark_resident(self, model_registry_key: str, model):
+        """ Remember a loaded model. It counts as resident as long as the registry keeps it alive. """
+        with self._lock:
+            try:
+                self._resident[model_registry_key] = model
+            except TypeError:
+                logger.debug(f"Model {model_registry_key} does not support weak references, not tracked.")
+
+    def is_resident(self, model_registry_key: str) -> bool:
+        with self._lock:
+            return model_registry_key in self._resident
+
+    @contextmanager
+    def track(self, model_registry_key: str):
+        """ Wait for a free inference slot of the model and record the latency of the wrapped call. """
+        with self._lock:
+            load = self._loads.setdefault(model_registry_key, ModelLoad())
+            semaphore = self._semaphores.setdefault(model_registry_key, threading.Semaphore(self.max_concurrency))
+            load.queued += 1
+        try:
+            semaphore.acquire()
+        finally:
+            with self._lock:
+                load.queued -= 1
+        with self._lock:
+            load.in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            latency = time.perf_counter() - start
+            semaphore.release()
+            with self._lock:
+                load.in_flight -= 1
+                load.completed += 1
+                if load.avg_latency_s is None:
+                    load.avg_latency_s = latency
+                else:
+                    load.avg_latency_s += self.latency_smoothing * (latency - load.avg_latency_s)
+
+    def estimated_wait_s(self, model_registry_key: str) -> float | None:
+        """ Estimated time a new request of the model waits before it starts, None if no latency is known yet. """
+        with self._lock:
+            load = self._loads.get(model_registry_key)
+            if load is None:
+                return 0.0
+            if load.avg_latency_s is None:
+                return None if load.queued + load.in_flight else 0.0
+            busy = load.queued + load.in_flight
+            return max(0, busy - self.max_concurrency + 1) * load.avg_latency_s / self.max_concurrency
+
+    def report(self) -> dict:
+        """ Summarize readiness, load and memory headroom of this replica. """
+        with self._lock:
+            resident = dict(self._resident)
+            loads = {key: ModelLoad(**vars(load)) for key, load in self._loads.items()}
+
+        models = {}
+        for key in sorted(set(resident) | set(loads)):
+            load = loads.get(key, ModelLoad())
+            models[key] = {
+                "resident": key in resident,
+                "queued": load.queued,
+                "in_flight": load.in_flight,
+                "completed": load.completed,
+                "avg_latency_s": load.avg_latency_s,
+                "estimated_wait_s": self.estimated_wait_s(key),
+            }
+
+        memory = device_memory_info()
+        return {
+            "ready": self.ready,
+            "startup_complete": self.startup_complete.is_set(),
+            "startup_error": self.startup_error,
+            "max_concurrency_per_model": self.max_concurrency,
+            "queue_depth": sum(m["queued"] for m in models.values()),
+            "in_flight": sum(m["in_flight"] for m in models.values()),
+            "memory_free_bytes": memory[0] if memory else None,
+            "memory_total_bytes": memory[1] if memory else None,
+            "embedding_cache_bytes": EMBEDDING_CACHE.total_bytes,
+            "embedding_cache_free_bytes": EMBEDDING_CACHE.max_bytes - EMBEDDING_CACHE.total_bytes,
+            "models": models,
+        }
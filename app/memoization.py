@@ -0,0 +1,91 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from logging import getLogger
+
+from paths import RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_S
+
+logger = getLogger(__name__)
+
+
+def make_request_key(*parts) -> str:
+    """ Build a cache key from JSON serializable parts, e.g. model key, model version, hashes and prompts. """
+    serialized = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
+
+
+class ResultMemoizer:
+    """ TTL cache with single-flight coalescing in front of an expensive computation.
+
+    A cached result is returned while it is younger than ttl_s. Otherwise, the first caller of a key computes the
+    result and concurrent callers with the same key wait for and share it. Failed computations are not cached.
+    """
+    def __init__(self, ttl_s: float = RESULT_CACHE_TTL_S, max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._in_flight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get_or_compute(self, key: str, compute):
+        """ Return the cached result of key, or compute it once for all concurrent callers. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            if self.ttl_s > 0 and self.max_entries > 0:
+                self._entries[key] = (time.monotonic() + self.ttl_s, value)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.coalesced) / requests if requests else None,
+            }
@@ -0,0 +1,145 @@
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from logging import getLogger
+
+from paths import PREFETCH_LOOKAHEAD, PREFETCH_MIN_FREE_MEMORY_FRACTION
+from util.image_loading import load_request_image
+from util.memory import free_memory_fraction
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class PrefetchSession:
+    """ The ordered list of images a user is about to annotate and their current position in it. """
+    model_registry_key: str
+    image_urls: list[str]
+    current_index: int = 0
+    lookahead: int = PREFETCH_LOOKAHEAD
+    generation: int = 0
+    pending: list[str] = field(default_factory=list)
+
+
+class EmbeddingPrefetcher:
+    """ Computes the image embeddings of the upcoming images of annotation sessions in a background thread.
+
+    Prefetching has lower priority than interactive requests: the worker only starts encoding an image while no
+    interactive request is running. Pending work of a session is dropped when the session moves on, and all pending
+    work is dropped when free memory falls below PREFETCH_MIN_FREE_MEMORY_FRACTION.
+    """
+    def __init__(self, get_model):
+        self.get_model = get_model
+        self._sessions: dict[str, PrefetchSession] = {}
+        self._interactive_requests = 0
+        self._condition = threading.Condition()
+        self._worker = None
+        self._stopped = False
+
+    @contextmanager
+    def interactive(self):
+        """ Mark an interactive request as running, prefetching waits until it has finished. """
+        with self._condition:
+            self._interactive_requests += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._interactive_requests -= 1
+                self._condition.notify_all()
+
+    def register_session(self, user_id: str, model_registry_key: str, image_urls: list[str],
+                         current_index: int = 0, lookahead: int | None = None):
+        """ Register (or replace) the ordered image list of a session and schedule prefetching. """
+        with self._condition:
+            previous = self._sessions.get(user_id)
+            session = PrefetchSession(
+                model_registry_key=model_registry_key,
+                image_urls=list(image_urls),
+                lookahead=PREFETCH_LOOKAHEAD if lookahead is None else lookahead,
+                generation=previous.generation + 1 if previous else 0,
+            )
+            self._sessions[user_id] = session
+            self._schedule(session, current_index)
+        self._ensure_worker()
+
+    def advance(self, user_id: str, current_index: int):
+        """ Move a session to another image. Pending prefetches for the old position are cancelled. """
+        with self._condition:
+            session = self._sessions.get(user_id)
+            if session is None:
+                raise KeyError(f"No prefetch session registered for user {user_id}.")
+            session.generation += 1
+            self._schedule(session, current_index)
+
+    def cancel(self, user_id: str):
+        """ Remove a session and its pending prefetches. """
+        with self._condition:
+            self._sessions.pop(user_id, None)
+
+    def pending(self) -> int:
+        """ Number of images waiting to be prefetched over all sessions. """
+        with self._condition:
+            return sum(len(s.pending) for s in self._sessions.values())
+
+    def shutdown(self):
+        with self._condition:
+            self._stopped = True
+            self._sessions.clear()
+            self._condition.notify_all()
+        if self._worker is not None:
+            self._worker.join(timeout=5)
+
+    def _schedule(self, session: PrefetchSession, current_index: int):
+        """ Queue the current image and the next lookahead images. Needs to hold the condition. """
+        session.current_index = current_index
+        session.pending = session.image_urls[current_index:current_index + session.lookahead + 1]
+        self._condition.notify_all()
+
+    def _ensure_worker(self):
+        with self._condition:
+            if self._worker is None or not self._worker.is_alive():
+                self._stopped = False
+                self._worker = threading.Thread(target=self._run, name="embedding-prefetch", daemon=True)
+                self._worker.start()
+
+    def _next_job(self):
+        """ Block until an image can be prefetched and return (user_id, generation, session, image_url),
+        or None if the prefetcher was stopped. """
+        with self._condition:
+            while True:
+                if self._stopped:
+                    return None
+                if self._interactive_requests == 0:
+                    for user_id, session in self._sessions.items():
+                        if session.pending:
+                            return user_id, session.generation, session, session.pending.pop(0)
+                self._condition.wait()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            user_id, generation, session, image_url = job
+
+            if free_memory_fraction() < PREFETCH_MIN_FREE_MEMORY_FRACTION:
+                logger.warning("Memory pressure detected, cancelling all pending embedding prefetches.")
+                with self._condition:
+                    for s in self._sessions.values():
+                        s.pending.clear()
+                continue
+
+            try:
+                image = load_request_image(image_url)
+                with self._condition:
+                    # The session moved on or an interactive request arrived while the image was loading
+                    while self._interactive_requests > 0 and not self._stopped:
+                        self._condition.wait()
+                    if self._sessions.get(user_id) is not session or session.generation != generation:
+                        continue
+                model = self.get_model(session.model_registry_key)
+                model.get_image_embeddings(image)
+                logger.debug(f"Prefetched embeddings of {image_url} for user {user_id}.")
+            except Exception as e:
+                logger.warning(f"Failed to prefetch embeddings of {image_url}: {e}")
@@ -1,12 +1,17 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 import torch
 
+from app.state import CAPACITY_TRACKER, EMBEDDING_PREFETCHER, RESULT_CACHE
+from models.embedding_store import EMBEDDING_STORE
+
 
 router = APIRouter()
 
 
 @router.get("/health")
 async def health_check():
+    """ Liveness probe. Fails with 503 if startup failed for good, a restart is then the only way to recover. """
     # Check Device
     if torch.cuda.is_available():
         device_status = f"cuda ({torch.cuda.get_device_name(0)})"
@@ -15,8 +20,44 @@ async def health_check():
     else:
         device_status = "cpu"
 
+    if CAPACITY_TRACKER.startup_failed:
+        return JSONResponse(status_code=503, content={
+            "status": "error",
+            "startup_error": CAPACITY_TRACKER.startup_error,
+            "device": device_status,
+            "torch_version": torch.__version__
+        })
+
     return {
         "status": "ok",
         "device": device_status,
         "torch_version": torch.__version__
     }
+
+
+@router.get("/capacity")
+async def capacity():
+    """ Reports resident models, queue depth, in-flight work and estimated wait time per model, and memory
+        headroom of this replica. Meant for least-loaded and model-affinity routing across replicas. """
+    report = CAPACITY_TRACKER.report()
+    report["pending_prefetches"] = EMBEDDING_PREFETCHER.pending()
+    report["result_cache"] = RESULT_CACHE.stats()
+    report["embedding_store"] = EMBEDDING_STORE.stats() if EMBEDDING_STORE is not None else None
+    return report
+
+
+@router.get("/ready")
+async def readiness_check(model_registry_key: str | None = None):
+    """ Readiness probe. Fails with 503 while model registration at startup is still running or if it failed.
+        If model_registry_key is given, the response also reports whether that model is resident and the
+        estimated wait time for it. """
+    body = {
+        "status": "ready" if CAPACITY_TRACKER.ready else "not ready",
+        "startup_complete": CAPACITY_TRACKER.startup_complete.is_set(),
+        "startup_error": CAPACITY_TRACKER.startup_error,
+    }
+    if model_registry_key is not None:
+        body["model_registry_key"] = model_registry_key
+        body["model_resident"] = CAPACITY_TRACKER.is_resident(model_registry_key)
+        body["estimated_wait_s"] = CAPACITY_TRACKER.estimated_wait_s(model_registry_key)
+    return JSONResponse(status_code=200 if CAPACITY_TRACKER.ready else 503, content=body)
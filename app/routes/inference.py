@@ -1,34 +1,61 @@
+import threading
 from logging import getLogger
 
 from fastapi import APIRouter, HTTPException
 from iquana_toolbox.schemas.database.contours import Contour
 from iquana_toolbox.schemas.networking.http.services import PromptedSegmentationRequest
+from pydantic import BaseModel, Field
 
-from app.state import MODEL_REGISTRY
+from app.memoization import make_request_key
+from app.state import CAPACITY_TRACKER, EMBEDDING_PREFETCHER, RESULT_CACHE, get_model
+from models.cascade import ModelCascade
+from models.mask_generation import MaskGenerationConfig
+from paths import REQUEST_RECORD_PATH
+from util.hashing import hash_array
+from util.image_loading import load_request_image
 
 logger = getLogger(__name__)
 router = APIRouter()
+# Requests are handled in the threadpool, concurrent appends could otherwise interleave within a line
+_record_lock = threading.Lock()
 
 
-@router.post("/inference", tags=["inference"])
-async def inference(request: PromptedSegmentationRequest):
-    """Segment an image using 2D prompts.
-    
-    :param request: PromptedSegmentationRequest containing image_url, user_id, model_identifier, prompts and an optional previous mask.
-    :return: Segmentation result with contour.
-    """
-    # Load model from registry
-    model = MODEL_REGISTRY.get_model_by_alias(request.model_registry_key, "latest")
+class AutomaticSegmentationRequest(BaseModel):
+    """ Request to automatically generate mask proposals for a whole image. """
+    image_url: str
+    user_id: str | int
+    model_registry_key: str
+    config: MaskGenerationConfig = Field(default_factory=MaskGenerationConfig)
 
-    # Extract previous mask if provided
-    previous_mask = request.previous_mask.mask if request.previous_mask else None
 
-    # Run inference
-    masks, scores = model.process_prompted_request(
-        request.image,
-        request.prompts,
-        previous_mask,
-    )
+def _record_request(request: PromptedSegmentationRequest):
+    """ Append the request to REQUEST_RECORD_PATH, e.g. to tune the model cascade offline. """
+    line = request.model_dump_json() + "\n"
+    try:
+        with _record_lock, open(REQUEST_RECORD_PATH, "a") as f:
+            f.write(line)
+    except OSError as e:
+        logger.warning(f"Failed to record request: {e}")
+
+
+def _segment(model, model_registry_key, image, prompts, previous_mask):
+    """ Run prompted segmentation and convert the best mask to a contour.
+    :return: The contour and the registry key of the model that answered.
+    """
+    # Run inference, background prefetching waits until it has finished
+    with EMBEDDING_PREFETCHER.interactive():
+        if isinstance(model, ModelCascade):
+            # The cascade holds no weights, every stage call is tracked under the key of the stage model
+            cascade_result = model.run(image, prompts, previous_mask)
+            masks, scores = [cascade_result.mask], [cascade_result.score]
+            model_registry_key = cascade_result.model_registry_key
+        else:
+            with CAPACITY_TRACKER.track(model_registry_key):
+                masks, scores = model.process_prompted_request(
+                    image,
+                    prompts,
+                    previous_mask,
+                )
 
     # Convert masks and scores to proper format
     if not isinstance(masks, list):
@@ -41,11 +68,89 @@ async def inference(request: PromptedSegmentationRequest):
         binary_mask=masks[0],
         only_return_biggest_contour=True,  # We only want one contour
         confidence=float(scores[0]),
-        added_by=request.model_registry_key,
+        added_by=model_registry_key,
+    )
+    return result, model_registry_key
+
+
+@router.post("/inference", tags=["inference"])
+def inference(request: PromptedSegmentationRequest):
+    """Segment an image using 2D prompts.
+
+    Runs in the threadpool, requests for the same model queue up until an inference slot is free.
+    :param request: PromptedSegmentationRequest containing image_url, user_id, model_identifier, prompts and an optional previous mask.
+    :return: Segmentation result with contour.
+    """
+    if REQUEST_RECORD_PATH:
+        _record_request(request)
+
+    # Load model from registry
+    model = get_model(request.model_registry_key)
+
+    # Extract image and previous mask if provided
+    image = request.image
+    previous_mask = request.previous_mask.mask if request.previous_mask else None
+
+    # Identical requests share one computation and are served from the result cache for a short time
+    cache_key = make_request_key(
+        request.model_registry_key,
+        model.version_key,
+        hash_array(image),
+        request.prompts.model_dump(mode="json", exclude_none=True),
+        hash_array(previous_mask) if previous_mask is not None else None,
+    )
+    result, answered_by = RESULT_CACHE.get_or_compute(
+        cache_key,
+        lambda: _segment(model, request.model_registry_key, image, request.prompts, previous_mask),
     )
 
     return {
         "success": True,
         "message": "Successfully performed prompted segmentation.",
-        "result": result
+        "result": result,
+        "model_registry_key": answered_by,
+    }
+
+
+@router.post("/inference/automatic", tags=["inference"])
+def automatic_inference(request: AutomaticSegmentationRequest):
+    """Generate mask proposals for a whole image ("segment everything").
+
+    The image is encoded once per crop and a dense grid of point prompts is decoded in batches. Low quality and
+    duplicate masks are filtered before the proposals are converted to contours.
+    :param request: AutomaticSegmentationRequest containing image_url, user_id, model_identifier and the
+        generation parameters.
+    :return: List of contours, one per proposed object, sorted by predicted IoU.
+    """
+    model = get_model(request.model_registry_key)
+    image = load_request_image(request.image_url)
+
+    try:
+        with EMBEDDING_PREFETCHER.interactive(), CAPACITY_TRACKER.track(request.model_registry_key):
+            proposals = [
+                Contour.from_binary_mask(
+                    binary_mask=mask,
+                    only_return_biggest_contour=True,
+                    confidence=score,
+                    added_by=request.model_registry_key,
+                )
+                for mask, score in model.generate_masks(image, request.config)
+            ]
+    except NotImplementedError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "success": True,
+        "message": f"Successfully generated {len(proposals)} mask proposals.",
+        "result": proposals
+    }
+
+
+@router.get("/inference/cache", tags=["inference"])
+async def result_cache_stats():
+    """ Hit-rate statistics of the result cache of /inference. """
+    return {
+        "success": True,
+        "message": "Retrieved result cache statistics.",
+        "result": RESULT_CACHE.stats()
     }
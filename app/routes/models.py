@@ -1,14 +1,25 @@
 from logging import getLogger
 
 from fastapi import HTTPException, APIRouter
+from pydantic import BaseModel
 
-from app.state import MODEL_REGISTRY
+from app import state
+from app.state import EMBEDDING_PREFETCHER, MODEL_REGISTRY
 
 logger = getLogger(__name__)
 session_router = APIRouter(prefix="/annotation_session", tags=["annotation_session"])
 router = APIRouter()
 
 
+class PrefetchRequest(BaseModel):
+    """ The ordered list of images a user is about to annotate. """
+    user_id: str
+    model_registry_key: str
+    image_urls: list[str]
+    current_index: int = 0
+    lookahead: int | None = None
+
+
 @router.get("/models/all")
 async def list_models():
     """ Lists all available models in the registry. """
@@ -49,8 +60,49 @@ async def load_model(model_registry_key: str, user_id: str):
     """ Loads a model into the cache if not already loaded. This is a convenience endpoint; models are loaded
         automatically when needed, but this can be called at the start
         of an annotation session to preload the model."""
-    MODEL_REGISTRY.get_model_by_alias(model_registry_key, "latest")
+    state.get_model(model_registry_key)
     return {
         "success": True,
         "message": f"Loaded {model_registry_key} model information.",
     }
+
+
+@session_router.post("/prefetch")
+async def register_prefetch(request: PrefetchRequest):
+    """ Registers the images of an annotation session. The embeddings of the current and the next images are
+        computed in the background, so that moving to the next image does not pay the image encoder cost.
+        Registering again replaces the previous list of the user."""
+    EMBEDDING_PREFETCHER.register_session(
+        request.user_id,
+        request.model_registry_key,
+        request.image_urls,
+        current_index=request.current_index,
+        lookahead=request.lookahead,
+    )
+    return {
+        "success": True,
+        "message": f"Registered {len(request.image_urls)} images for prefetching.",
+    }
+
+
+@session_router.post("/prefetch/advance")
+async def advance_prefetch(user_id: str, current_index: int):
+    """ Moves the session to another image. Pending prefetches for the previous position are cancelled. """
+    try:
+        EMBEDDING_PREFETCHER.advance(user_id, current_index)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {
+        "success": True,
+        "message": f"Moved prefetching to image {current_index}.",
+    }
+
+
+@session_router.delete("/prefetch")
+async def cancel_prefetch(user_id: str):
+    """ Cancels all pending prefetches of the session. """
+    EMBEDDING_PREFETCHER.cancel(user_id)
+    return {
+        "success": True,
+        "message": "Cancelled prefetching.",
+    }
@@ -1,5 +1,59 @@
+import threading
+import time
+from logging import getLogger
+
 from iquana_toolbox.mlflow import MLFlowModelRegistry
+from mlflow import MlflowClient
+
+from app.capacity import CapacityTracker
+from app.memoization import ResultMemoizer
+from app.prefetch import EmbeddingPrefetcher
+from models.cascade import ModelCascade
+from paths import MLFLOW_URL, REGISTRY_VERSION_TTL_S
 
-from paths import MLFLOW_URL
+logger = getLogger(__name__)
 
 MODEL_REGISTRY = MLFlowModelRegistry(MLFLOW_URL)
+MLFLOW_CLIENT = MlflowClient(tracking_uri=MLFLOW_URL, registry_uri=MLFLOW_URL)
+CAPACITY_TRACKER = CapacityTracker()
+RESULT_CACHE = ResultMemoizer()
+
+_registry_versions: dict[str, tuple[float, str | None]] = {}
+_registry_versions_lock = threading.Lock()
+
+
+def get_registry_version(model_registry_key: str) -> str | None:
+    """ The registry version the "latest" alias of a model points to, or None if the registry cannot tell.
+    Lookups, failed ones included, are reused for REGISTRY_VERSION_TTL_S, so that a slow or unreachable registry
+    does not delay every request. """
+    with _registry_versions_lock:
+        cached = _registry_versions.get(model_registry_key)
+    if cached is not None and time.monotonic() - cached[0] < REGISTRY_VERSION_TTL_S:
+        return cached[1]
+    try:
+        version = str(MLFLOW_CLIENT.get_model_version_by_alias(model_registry_key, "latest").version)
+    except Exception as e:
+        logger.warning(f"Could not resolve the registry version of {model_registry_key}: {e}")
+        version = None
+    with _registry_versions_lock:
+        _registry_versions[model_registry_key] = (time.monotonic(), version)
+    return version
+
+
+def get_model(model_registry_key: str):
+    """ Load the latest version of a model from the registry and remember it as resident. The registry version is
+    attached to the model once, it becomes part of its version_key, so that results cached for an older version
+    are not served after the alias moves on. Model cascades get a resolver attached, so that they can load their
+    stage models the same way, and run every stage under the capacity tracking of the stage model. """
+    model = MODEL_REGISTRY.get_model_by_alias(model_registry_key, "latest")
+    if getattr(model, "registry_version", None) is None:
+        model.registry_version = get_registry_version(model_registry_key)
+    if isinstance(model, ModelCascade):
+        model.resolve_model = get_model
+        model.resolve_version = get_registry_version
+        model.track_stage = CAPACITY_TRACKER.track
+    CAPACITY_TRACKER.mark_resident(model_registry_key, model)
+    return model
+
+
+EMBEDDING_PREFETCHER = EmbeddingPrefetcher(get_model)
@@ -0,0 +1,100 @@
+"""Benchmark reduced image encoder input sizes against the 1024 px baseline.
+
+For every image a fixed set of random single point prompts is segmented at the baseline input size and at each of the
+given reduced input sizes. The script reports the encoder and decoder latency, the speedup of the encoder and the IoU
+of the masks with the baseline masks.
+
+Usage:
+    python benchmark_input_size.py path/to/images --model facebook/sam2.1-hiera-tiny --sizes 512,768
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from iquana_toolbox.schemas.prompts import PointPrompt, Prompts
+
+from models.sam2 import DEFAULT_INPUT_SIZE, SAMPrompted
+from util.image_loading import load_image_from_url
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+
+
+def mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    a, b = a > 0, b > 0
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def run(model: SAMPrompted, image, prompts: list[Prompts]):
+    """Return the encoder latency, the mean decoder latency and the masks of all prompts."""
+    model.embedding_cache.clear()
+    start = time.perf_counter()
+    # Bypass the persistent store, the image encoder is what is measured
+    model.get_image_embeddings(image, use_store=False)
+    encode_s = time.perf_counter() - start
+
+    masks, decode_s = [], []
+    for prompt in prompts:
+        start = time.perf_counter()
+        mask, _, _ = model.predict_with_quality(image, prompt)
+        decode_s.append(time.perf_counter() - start)
+        masks.append(mask)
+    return encode_s, float(np.mean(decode_s)), masks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", help="Folder with benchmark images.")
+    parser.add_argument("--model", default="facebook/sam2.1-hiera-tiny", help="Hugging Face model name or path.")
+    parser.add_argument("--sizes", default="512,768", help="Comma separated encoder input sizes to compare.")
+    parser.add_argument("--points", type=int, default=10, help="Random point prompts per image.")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N images.")
+    parser.add_argument("--device", default="auto")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    image_paths = sorted(
+        os.path.join(args.images, name) for name in os.listdir(args.images) if name.lower().endswith(IMAGE_EXTENSIONS)
+    )[:args.limit]
+    rng = np.random.default_rng(args.seed)
+    prompts = {
+        path: [Prompts(point_prompts=[PointPrompt(x=float(x), y=float(y), label=1)])
+               for x, y in rng.uniform(0.05, 0.95, size=(args.points, 2))]
+        for path in image_paths
+    }
+    sizes = [DEFAULT_INPUT_SIZE] + [int(size) for size in args.sizes.split(",")]
+
+    baseline_masks = {}
+    results = {}
+    for size in sizes:
+        model = SAMPrompted(args.model, device=args.device, input_size=size)
+        # Warm up, the first forward pass includes one-time initialization
+        run(model, load_image_from_url(image_paths[0]), prompts[image_paths[0]][:1])
+        encode, decode, ious = [], [], []
+        for path in image_paths:
+            image = load_image_from_url(path)
+            encode_s, decode_s, masks = run(model, image, prompts[path])
+            encode.append(encode_s)
+            decode.append(decode_s)
+            if size == DEFAULT_INPUT_SIZE:
+                baseline_masks[path] = masks
+            else:
+                ious.extend(mask_iou(mask, reference) for mask, reference in zip(masks, baseline_masks[path]))
+        results[size] = (float(np.mean(encode)), float(np.mean(decode)), ious)
+        del model
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    baseline_encode_s = results[DEFAULT_INPUT_SIZE][0]
+    print(f"{args.model}, {len(image_paths)} images, {args.points} prompts per image")
+    print(f"{'size':>6} {'encode_s':>9} {'decode_s':>9} {'speedup':>8} {'mean_iou':>9} {'p10_iou':>8}")
+    for size, (encode_s, decode_s, ious) in results.items():
+        mean_iou = f"{np.mean(ious):9.3f}" if ious else f"{'-':>9}"
+        p10_iou = f"{np.percentile(ious, 10):8.3f}" if ious else f"{'-':>8}"
+        print(f"{size:>6} {encode_s:9.3f} {decode_s:9.4f} {baseline_encode_s / encode_s:7.2f}x {mean_iou} {p10_iou}")
+
+
+if __name__ == "__main__":
+    main()
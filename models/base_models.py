@@ -5,6 +5,14 @@ from abc import ABC, abstractmethod
 
 class Prompted2DBaseModel(torch.nn.Module, ABC):
     """ Abstract base class for 2D prompted segmentation models. """
+    # Registry version the model was loaded from, attached by the service after loading
+    registry_version: str | None = None
+
+    @property
+    def version_key(self) -> str:
+        """ Identifies the weights and configuration of this model instance. Used to key cached results. """
+        return f"{type(self).__name__}-{id(self)}"
+
     @abstractmethod
     def process_prompted_request(self, image, prompts: Prompts, previous_mask=None):
         """ Process a prompted segmentation request.
@@ -14,3 +22,11 @@ class Prompted2DBaseModel(torch.nn.Module, ABC):
         :return: A tuple containing a mask and their corresponding quality score.
         """
         pass
+
+    def generate_masks(self, image, config=None):
+        """ Automatically generate mask proposals for the whole image ("segment everything").
+        :param image: The input image to be segmented.
+        :param config: Optional MaskGenerationConfig with the generation parameters.
+        :return: An iterable of tuples containing a mask and its corresponding quality score.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support automatic mask generation.")
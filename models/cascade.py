@@ -0,0 +1,118 @@
+from contextlib import nullcontext
+from dataclasses import dataclass
+from logging import getLogger
+from os import getenv
+from typing import Callable, ContextManager
+
+from iquana_toolbox.schemas.prompts import Prompts
+
+from models.base_models import Prompted2DBaseModel
+from paths import DEFAULT_CASCADE_MIN_IOU, DEFAULT_CASCADE_STAGES
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class CascadeResult:
+    """ Result of a cascade run and the registry key of the model that produced it. """
+    mask: object
+    score: float
+    stability: float | None
+    model_registry_key: str
+    escalations: int
+
+
+class ModelCascade(Prompted2DBaseModel):
+    """ Runs the fastest model first and only escalates to the next (larger) model if the predicted IoU score or the
+    mask stability of the answer falls below the thresholds. The last stage always answers.
+
+    The cascade holds no weights itself, its stage models are looked up through resolve_model, which is attached by
+    the service after the cascade was loaded from the registry, together with resolve_version, which returns the
+    registry version of a stage without loading it, and track_stage, which wraps every stage call so that it counts
+    towards the load of the stage model. Stages and thresholds that are None are read from the environment variables
+    CASCADE_STAGES, CASCADE_MIN_IOU and CASCADE_MIN_STABILITY on every request, so they can be tuned without
+    re-registering.
+    """
+    def __init__(self, stages: list[str] | None = None, min_iou: float | None = None,
+                 min_stability: float | None = None):
+        super().__init__()
+        self.stages = stages
+        self.min_iou = min_iou
+        self.min_stability = min_stability
+        self.resolve_model: Callable[[str], Prompted2DBaseModel] | None = None
+        self.resolve_version: Callable[[str], str | None] | None = None
+        self.track_stage: Callable[[str], ContextManager] | None = None
+
+    @property
+    def thresholds(self) -> tuple[list[str], float, float | None]:
+        """ The effective stages, minimum IoU score and minimum stability score. """
+        min_stability = self.min_stability
+        if min_stability is None and getenv("CASCADE_MIN_STABILITY"):
+            min_stability = float(getenv("CASCADE_MIN_STABILITY"))
+        return (
+            self.stages if self.stages is not None else getenv("CASCADE_STAGES", DEFAULT_CASCADE_STAGES).split(","),
+            self.min_iou if self.min_iou is not None else float(getenv("CASCADE_MIN_IOU", DEFAULT_CASCADE_MIN_IOU)),
+            min_stability,
+        )
+
+    @property
+    def version_key(self) -> str:
+        """ Includes the registry versions of the stages, so that a new version of any stage changes the key. The
+        stage models are not loaded for this, a later stage is only loaded once a request escalates to it. """
+        stages, min_iou, min_stability = self.thresholds
+        if self.resolve_version is not None:
+            stages = [f"{stage}@{self.resolve_version(stage)}" for stage in stages]
+        return f"{type(self).__name__}-{','.join(stages)}-{min_iou}-{min_stability}"
+
+    def accepts(self, score: float, stability: float | None) -> bool:
+        """ Whether an answer is confident enough to not escalate. """
+        _, min_iou, min_stability = self.thresholds
+        if score < min_iou:
+            return False
+        return min_stability is None or stability is None or stability >= min_stability
+
+    def run(self, image, prompts: Prompts, previous_mask=None) -> CascadeResult:
+        """ Run the stages in order until one of them is confident enough. """
+        stages, _, _ = self.thresholds
+        for i, model_registry_key in enumerate(stages):
+            model = self._resolve(model_registry_key)
+            with self._track(model_registry_key):
+                if hasattr(model, "predict_with_quality"):
+                    mask, score, stability = model.predict_with_quality(image, prompts, previous_mask)
+                else:
+                    masks, scores = model.process_prompted_request(image, prompts, previous_mask)
+                    mask, score, stability = masks[0], scores[0], None
+            is_last = i == len(stages) - 1
+            if is_last or self.accepts(float(score), stability):
+                return CascadeResult(mask, float(score), stability, model_registry_key, escalations=i)
+            logger.debug(f"Escalating from {model_registry_key}: score {float(score):.3f}, stability {stability}.")
+
+    def process_prompted_request(self, image, prompts: Prompts, previous_mask=None):
+        result = self.run(image, prompts, previous_mask)
+        return [result.mask], [result.score]
+
+    def get_image_embeddings(self, image):
+        """ Prefetching for the cascade warms the embedding cache of the first stage, which answers most requests. """
+        stages, _, _ = self.thresholds
+        return self._resolve(stages[0]).get_image_embeddings(image)
+
+    def _resolve(self, model_registry_key: str) -> Prompted2DBaseModel:
+        if self.resolve_model is None:
+            raise RuntimeError("The model cascade has no model resolver attached.")
+        return self.resolve_model(model_registry_key)
+
+    def _track(self, model_registry_key: str) -> ContextManager:
+        return nullcontext() if self.track_stage is None else self.track_stage(model_registry_key)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["resolve_model"] = None
+        state["resolve_version"] = None
+        state["track_stage"] = None
+        return state
+
+    def __setstate__(self, state):
+        # Cascades pickled before these hooks existed
+        state.setdefault("resolve_version", None)
+        state.setdefault("track_stage", None)
+        super().__setstate__(state)
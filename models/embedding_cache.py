@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+from paths import EMBEDDING_CACHE_MAX_BYTES
+
+
+class EmbeddingCache:
+    """ Thread-safe LRU cache for image embeddings, bounded by the total size of the cached tensors in bytes.
+    Entries are lists of tensors as returned by the image encoder. The cache is never pickled with a model,
+    a model restored from the registry starts with an empty cache.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        """ Return the cached entry for key and mark it as most recently used, or None. """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, embeddings: list[torch.Tensor]):
+        """ Insert an entry and evict the least recently used entries until the cache fits into max_bytes. """
+        size = sum(t.numel() * t.element_size() for t in embeddings)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._sizes.pop(key)
+                del self._entries[key]
+            self._entries[key] = embeddings
+            self._sizes[key] = size
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                evicted, _ = self._entries.popitem(last=False)
+                self._total_bytes -= self._sizes.pop(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._total_bytes = 0
+
+    def __getstate__(self):
+        return {"max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_bytes"])
+
+
+# Shared by all models, so that the budget does not grow with the number of resident models. Entries are keyed by
+# (model version key, image hash).
+EMBEDDING_CACHE = EmbeddingCache(EMBEDDING_CACHE_MAX_BYTES)
@@ -0,0 +1,194 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from logging import getLogger
+
+import numpy as np
+import torch
+
+from paths import EMBEDDING_STORE_DIR, EMBEDDING_STORE_FP16, EMBEDDING_STORE_MAX_BYTES
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, eviction is then only safe within one process
+    fcntl = None
+
+logger = getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+
+class EmbeddingStore:
+    """ Persistent store for image embeddings, shared across restarts and, on a shared volume, across replicas.
+
+    Every entry is a directory <root>/<model version>/<hash[:2]>/<hash> with one .npy file per feature level and a
+    manifest with the shape and dtype of every level. Levels are read back memory-mapped, in the dtype they were
+    stored in. Entries are written to a temporary directory first and renamed into place, so readers never see
+    partial entries and concurrent writers of the same entry do not conflict. Entries are removed by renaming them
+    to a tombstone first, so readers of another process see either the complete entry or none. Anything that does
+    not match the manifest is a miss. When the store grows beyond max_bytes, the least recently used entries are
+    evicted under an exclusive file lock. Reads refresh the modification time of an entry, which serves as its
+    last use.
+    """
+    def __init__(self, root: str, max_bytes: int, fp16: bool = False):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.fp16 = fp16
+        self.hits = 0
+        self.misses = 0
+        self._approx_bytes = None
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-store")
+
+    def _entry_dir(self, version_key: str, image_hash: str) -> str:
+        safe_version = version_key.replace(os.sep, "--").replace("/", "--")
+        return os.path.join(self.root, safe_version, image_hash[:2], image_hash)
+
+    def contains(self, version_key: str, image_hash: str) -> bool:
+        return os.path.isfile(os.path.join(self._entry_dir(version_key, image_hash), MANIFEST))
+
+    def get(self, version_key: str, image_hash: str) -> list[torch.Tensor] | None:
+        """ Load the embeddings of an image, or return None if they are not stored. The tensors are memory-mapped
+        and have the stored dtype, convert them with a single .to(device, dtype) call. """
+        entry_dir = self._entry_dir(version_key, image_hash)
+        try:
+            with open(os.path.join(entry_dir, MANIFEST)) as f:
+                levels = json.load(f)["levels"]
+            embeddings = []
+            for i, level in enumerate(levels):
+                # Copy-on-write mapping, the array is writable without copying the file into memory
+                array = np.load(os.path.join(entry_dir, f"{i}.npy"), mmap_mode="c")
+                if list(array.shape) != level["shape"] or array.dtype.str != level["dtype"]:
+                    raise ValueError(f"Level {i} does not match the manifest.")
+                embeddings.append(torch.from_numpy(array))
+            os.utime(entry_dir)
+        except (FileNotFoundError, ValueError, KeyError, OSError) as e:
+            # Not stored, evicted by another process while reading, or damaged
+            if not isinstance(e, FileNotFoundError):
+                logger.debug(f"Ignoring stored embeddings of {image_hash}: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return embeddings
+
+    def put(self, version_key: str, image_hash: str, embeddings: list[torch.Tensor], wait: bool = False):
+        """ Store the embeddings of an image. Writing happens in a background thread unless wait is True. """
+        arrays = [t.detach().to("cpu", torch.float16 if self.fp16 else torch.float32).numpy() for t in embeddings]
+        future = self._writer.submit(self._write, version_key, image_hash, arrays)
+        if wait:
+            future.result()
+
+    def flush(self):
+        """ Wait until all pending writes are done. """
+        self._writer.submit(lambda: None).result()
+
+    def _write(self, version_key: str, image_hash: str, arrays: list[np.ndarray]):
+        entry_dir = self._entry_dir(version_key, image_hash)
+        if os.path.isfile(os.path.join(entry_dir, MANIFEST)):
+            return
+        if os.path.isdir(entry_dir):
+            # An entry without manifest was damaged or written by an older version of the store
+            self._remove(entry_dir)
+        tmp_dir = os.path.join(self.root, ".tmp", uuid.uuid4().hex)
+        try:
+            os.makedirs(tmp_dir)
+            for i, array in enumerate(arrays):
+                np.save(os.path.join(tmp_dir, f"{i}.npy"), array)
+            # The manifest is written last, an entry is only complete with it
+            with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+                json.dump({"levels": [{"shape": list(a.shape), "dtype": a.dtype.str} for a in arrays]}, f)
+            os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                # Another writer stored the same entry first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+        except OSError as e:
+            logger.warning(f"Failed to store embeddings of {image_hash}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = self._scan_size()
+            else:
+                self._approx_bytes += sum(a.nbytes for a in arrays)
+            if self._approx_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """ Yield (last_use, size_bytes, path) of all entries. """
+        for version in os.scandir(self.root):
+            if not version.is_dir() or version.name.startswith("."):
+                continue
+            for prefix in os.scandir(version.path):
+                if not prefix.is_dir():
+                    continue
+                for entry in os.scandir(prefix.path):
+                    try:
+                        size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                        yield entry.stat().st_mtime, size, entry.path
+                    except FileNotFoundError:
+                        continue
+
+    def _remove(self, path: str):
+        """ Remove an entry atomically for readers: rename it to a tombstone, then delete the tombstone. """
+        tombstone = os.path.join(self.root, ".tmp", f"removed-{uuid.uuid4().hex}")
+        try:
+            os.makedirs(os.path.dirname(tombstone), exist_ok=True)
+            os.rename(path, tombstone)
+        except OSError:
+            # Already removed by another process
+            return
+        shutil.rmtree(tombstone, ignore_errors=True)
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    @contextmanager
+    def _exclusive(self):
+        """ Exclusive lock over all processes using the store. """
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _evict(self):
+        """ Remove the least recently used entries until the store uses at most 90% of max_bytes. """
+        with self._exclusive():
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                self._remove(path)
+                total -= size
+            self._approx_bytes = total
+        logger.debug(f"Evicted embeddings, the store now uses {total} bytes.")
+
+    def stats(self) -> dict:
+        return {
+            "root": self.root,
+            "approx_bytes": self._approx_bytes,
+            "max_bytes": self.max_bytes,
+            "fp16": self.fp16,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+EMBEDDING_STORE = (
+    EmbeddingStore(EMBEDDING_STORE_DIR, EMBEDDING_STORE_MAX_BYTES, EMBEDDING_STORE_FP16)
+    if EMBEDDING_STORE_DIR and EMBEDDING_STORE_MAX_BYTES > 0 else None
+)
@@ -0,0 +1,156 @@
+import math
+from dataclasses import dataclass
+
+import numpy as np
+import torch
+
+# Upper bounds of the work a single request can ask for, every crop is encoded once and decodes points_per_side**2
+# point prompts
+MAX_POINTS_PER_SIDE = 64
+MAX_POINTS_PER_BATCH = 256
+MAX_CROP_N_LAYERS = 2
+
+
+@dataclass
+class MaskGenerationConfig:
+    """ Parameters for automatic ("segment everything") mask generation.
+    :param points_per_side: Number of grid points sampled along each side of the (cropped) image.
+    :param points_per_batch: Number of point prompts decoded together in a single forward pass of the mask decoder.
+    :param pred_iou_thresh: Minimum predicted IoU score for a mask to be kept.
+    :param stability_score_thresh: Minimum stability score for a mask to be kept.
+    :param stability_score_offset: Offset by which the mask threshold is shifted when computing the stability score.
+    :param mask_threshold: Threshold on the mask logits used for binarization.
+    :param box_nms_thresh: IoU threshold of the box NMS used to remove duplicates within a crop.
+    :param crop_n_layers: Number of additional crop layers. Layer i splits the image into (2**i)**2 overlapping crops.
+    :param crop_nms_thresh: IoU threshold of the box NMS used to remove duplicates between crops.
+    :param crop_overlap_ratio: Fraction of the crop size by which neighbouring crops overlap.
+    :param crop_n_points_downscale_factor: Points per side are divided by this factor**i in crop layer i.
+    :param min_mask_region_area: Masks with fewer pixels than this (in the original image) are discarded.
+    :param max_masks: Optional upper bound on the number of returned masks, highest scoring first. Applied after
+        the min_mask_region_area filter.
+    """
+    points_per_side: int = 32
+    points_per_batch: int = 64
+    pred_iou_thresh: float = 0.88
+    stability_score_thresh: float = 0.95
+    stability_score_offset: float = 1.0
+    mask_threshold: float = 0.0
+    box_nms_thresh: float = 0.7
+    crop_n_layers: int = 0
+    crop_nms_thresh: float = 0.7
+    crop_overlap_ratio: float = 512 / 1500
+    crop_n_points_downscale_factor: int = 1
+    min_mask_region_area: int = 0
+    max_masks: int | None = None
+
+    def __post_init__(self):
+        """ Reject values that would crash or make the generation unbounded. Raised as ValueError, so that
+        requests with invalid values are answered with 422. """
+        bounds = {
+            "points_per_side": (1, MAX_POINTS_PER_SIDE),
+            "points_per_batch": (1, MAX_POINTS_PER_BATCH),
+            "crop_n_layers": (0, MAX_CROP_N_LAYERS),
+            "crop_n_points_downscale_factor": (1, None),
+            "min_mask_region_area": (0, None),
+            "max_masks": (1, None),
+            "stability_score_offset": (0, None),
+            "box_nms_thresh": (0, 1),
+            "crop_nms_thresh": (0, 1),
+            "crop_overlap_ratio": (0, 0.99),
+        }
+        for name, (low, high) in bounds.items():
+            value = getattr(self, name)
+            if value is None:
+                continue
+            if value < low or (high is not None and value > high):
+                raise ValueError(f"{name} must be between {low} and {high if high is not None else 'inf'}, "
+                                 f"got {value}.")
+
+
+def build_point_grid(n_per_side: int) -> np.ndarray:
+    """ Build a regular grid of n_per_side x n_per_side points, normalized to [0, 1].
+    :return: Array of shape [n_per_side**2, 2] with (x, y) coordinates.
+    """
+    offset = 1 / (2 * n_per_side)
+    points_one_side = np.linspace(offset, 1 - offset, n_per_side)
+    points_x = np.tile(points_one_side[None, :], (n_per_side, 1))
+    points_y = np.tile(points_one_side[:, None], (1, n_per_side))
+    return np.stack([points_x, points_y], axis=-1).reshape(-1, 2)
+
+
+def generate_crop_boxes(image_size: tuple[int, int], n_layers: int, overlap_ratio: float):
+    """ Generate the crop boxes of all crop layers. Layer 0 is always the full image.
+    :param image_size: (height, width) of the image.
+    :param n_layers: Number of additional crop layers.
+    :param overlap_ratio: Fraction of the crop size by which neighbouring crops overlap.
+    :return: A tuple of a list of [x0, y0, x1, y1] crop boxes and a list with the layer index of each box.
+    """
+    im_h, im_w = image_size
+    short_side = min(im_h, im_w)
+    crop_boxes = [[0, 0, im_w, im_h]]
+    layer_idxs = [0]
+
+    def crop_len(orig_len, n_crops, overlap):
+        return int(math.ceil((overlap * (n_crops - 1) + orig_len) / n_crops))
+
+    for i_layer in range(n_layers):
+        n_crops_per_side = 2 ** (i_layer + 1)
+        overlap = int(overlap_ratio * short_side * (2 / n_crops_per_side))
+        crop_w = crop_len(im_w, n_crops_per_side, overlap)
+        crop_h = crop_len(im_h, n_crops_per_side, overlap)
+        for x0 in [int((crop_w - overlap) * i) for i in range(n_crops_per_side)]:
+            for y0 in [int((crop_h - overlap) * i) for i in range(n_crops_per_side)]:
+                crop_boxes.append([x0, y0, min(x0 + crop_w, im_w), min(y0 + crop_h, im_h)])
+                layer_idxs.append(i_layer + 1)
+    return crop_boxes, layer_idxs
+
+
+def calculate_stability_score(mask_logits: torch.Tensor, mask_threshold: float, offset: float) -> torch.Tensor:
+    """ Stability score of a batch of masks: the IoU between the binary masks obtained by thresholding the
+    logits at mask_threshold + offset and mask_threshold - offset.
+    :param mask_logits: Tensor of shape [N, H, W].
+    :return: Tensor of shape [N].
+    """
+    intersections = (mask_logits > (mask_threshold + offset)).sum(dim=(-1, -2), dtype=torch.int32)
+    unions = (mask_logits > (mask_threshold - offset)).sum(dim=(-1, -2), dtype=torch.int32)
+    return intersections / unions.clamp(min=1)
+
+
+def batched_mask_to_box(masks: torch.Tensor) -> torch.Tensor:
+    """ Compute the [x0, y0, x1, y1] bounding boxes of a batch of binary masks. Empty masks get [0, 0, 0, 0].
+    :param masks: Boolean tensor of shape [N, H, W].
+    :return: Tensor of shape [N, 4].
+    """
+    if masks.numel() == 0:
+        return torch.zeros(*masks.shape[:-2], 4, device=masks.device)
+    h, w = masks.shape[-2:]
+    in_height, _ = torch.max(masks, dim=-1)
+    in_height_coords = in_height * torch.arange(h, device=masks.device)[None, :]
+    bottom_edges, _ = torch.max(in_height_coords, dim=-1)
+    in_height_coords = in_height_coords + h * (~in_height)
+    top_edges, _ = torch.min(in_height_coords, dim=-1)
+
+    in_width, _ = torch.max(masks, dim=-2)
+    in_width_coords = in_width * torch.arange(w, device=masks.device)[None, :]
+    right_edges, _ = torch.max(in_width_coords, dim=-1)
+    in_width_coords = in_width_coords + w * (~in_width)
+    left_edges, _ = torch.min(in_width_coords, dim=-1)
+
+    empty = (right_edges < left_edges) | (bottom_edges < top_edges)
+    boxes = torch.stack([left_edges, top_edges, right_edges, bottom_edges], dim=-1)
+    return boxes * (~empty).unsqueeze(-1)
+
+
+def is_box_near_crop_edge(boxes: torch.Tensor, crop_box: list[int], orig_box: list[int], atol: float = 20.0):
+    """ Check which boxes touch the border of a crop without touching the border of the original image. Such masks
+    are most likely cut off by the crop and are better predicted by a different crop.
+    :param boxes: Tensor of shape [N, 4] in original image coordinates.
+    :return: Boolean tensor of shape [N].
+    """
+    crop_box_torch = torch.as_tensor(crop_box, dtype=torch.float, device=boxes.device)
+    orig_box_torch = torch.as_tensor(orig_box, dtype=torch.float, device=boxes.device)
+    boxes = boxes.float()
+    near_crop_edge = torch.isclose(boxes, crop_box_torch[None, :], atol=atol, rtol=0)
+    near_image_edge = torch.isclose(boxes, orig_box_torch[None, :], atol=atol, rtol=0)
+    near_crop_edge = torch.logical_and(near_crop_edge, ~near_image_edge)
+    return torch.any(near_crop_edge, dim=1)
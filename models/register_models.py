@@ -3,6 +3,7 @@ from typing import Callable
 
 from iquana_toolbox.mlflow import MLFlowModelRegistry
 
+from models.cascade import ModelCascade
 from models.sam2 import SAMPrompted
 
 logger = logging.getLogger(__name__)
@@ -24,6 +25,7 @@ MODEL_REGISTRY_CONFIG = [
             "prompt_types_supported": "point,box",
             "refinement_supported": "true",
             "requires_gpu": "false",
+            "input_size": "1024",
         }
     },
     {
@@ -42,6 +44,7 @@ MODEL_REGISTRY_CONFIG = [
             "prompt_types_supported": "point,box",
             "refinement_supported": "true",
             "requires_gpu": "true",
+            "input_size": "1024",
         }
     },
     {
@@ -60,6 +63,7 @@ MODEL_REGISTRY_CONFIG = [
             "prompt_types_supported": "point,box",
             "refinement_supported": "true",
             "requires_gpu": "true",
+            "input_size": "1024",
         }
     },
     {
@@ -78,6 +82,102 @@ MODEL_REGISTRY_CONFIG = [
             "prompt_types_supported": "point,box",
             "refinement_supported": "true",
             "requires_gpu": "true",
+            "input_size": "1024",
+        }
+    },
+    {
+        "model_identifier": "sam2-1-tiny-512",
+        "model_factory": lambda: SAMPrompted("facebook/sam2.1-hiera-tiny", input_size=512),
+        "desc": "Segment Anything Model 2.1 - Tiny variant with the image encoder running at 512 px instead of 1024 px. Roughly a quarter of the encoder cost of the tiny variant, for real-time previews on CPU-only machines. Masks are coarser, especially for thin structures. Supports point and box prompts.",
+        "tags": {
+            "task": "prompted-segmentation",
+            "status": "ready",
+            "pretrained": "true",
+            "trainable": "false",
+            "finetunable": "false",
+            "model_size": "tiny",
+            "inference_speed": "realtime",
+            "accuracy_level": "lowest",
+            "prompt_types_supported": "point,box",
+            "refinement_supported": "true",
+            "requires_gpu": "false",
+            "input_size": "512",
+        }
+    },
+    {
+        "model_identifier": "sam2-1-tiny-768",
+        "model_factory": lambda: SAMPrompted("facebook/sam2.1-hiera-tiny", input_size=768),
+        "desc": "Segment Anything Model 2.1 - Tiny variant with the image encoder running at 768 px instead of 1024 px. About half of the encoder cost of the tiny variant with a small loss in mask quality. Suitable for fast interactive use on CPU. Supports point and box prompts.",
+        "tags": {
+            "task": "prompted-segmentation",
+            "status": "ready",
+            "pretrained": "true",
+            "trainable": "false",
+            "finetunable": "false",
+            "model_size": "tiny",
+            "inference_speed": "fastest",
+            "accuracy_level": "low",
+            "prompt_types_supported": "point,box",
+            "refinement_supported": "true",
+            "requires_gpu": "false",
+            "input_size": "768",
+        }
+    },
+    {
+        "model_identifier": "sam2-1-small-512",
+        "model_factory": lambda: SAMPrompted("facebook/sam2.1-hiera-small", input_size=512),
+        "desc": "Segment Anything Model 2.1 - Small variant with the image encoder running at 512 px instead of 1024 px. Roughly a quarter of the encoder cost of the small variant, for fast previews on CPU-only machines. Masks are coarser, especially for thin structures. Supports point and box prompts.",
+        "tags": {
+            "task": "prompted-segmentation",
+            "status": "ready",
+            "pretrained": "true",
+            "trainable": "false",
+            "finetunable": "false",
+            "model_size": "small",
+            "inference_speed": "fastest",
+            "accuracy_level": "low",
+            "prompt_types_supported": "point,box",
+            "refinement_supported": "true",
+            "requires_gpu": "false",
+            "input_size": "512",
+        }
+    },
+    {
+        "model_identifier": "sam2-1-small-768",
+        "model_factory": lambda: SAMPrompted("facebook/sam2.1-hiera-small", input_size=768),
+        "desc": "Segment Anything Model 2.1 - Small variant with the image encoder running at 768 px instead of 1024 px. About half of the encoder cost of the small variant with a small loss in mask quality. Supports point and box prompts.",
+        "tags": {
+            "task": "prompted-segmentation",
+            "status": "ready",
+            "pretrained": "true",
+            "trainable": "false",
+            "finetunable": "false",
+            "model_size": "small",
+            "inference_speed": "fast",
+            "accuracy_level": "medium",
+            "prompt_types_supported": "point,box",
+            "refinement_supported": "true",
+            "requires_gpu": "false",
+            "input_size": "768",
+        }
+    },
+    {
+        "model_identifier": "auto",
+        "model_factory": lambda: ModelCascade(),
+        "desc": "Adaptive cascade of Segment Anything Model 2.1 variants. Runs the tiny variant first and re-runs the request on a larger variant only if the predicted IoU score or the mask stability falls below the configured thresholds. Fast on easy objects while keeping the accuracy of the large variant on hard ones. The response reports which model answered. Supports point and box prompts.",
+        "tags": {
+            "task": "prompted-segmentation",
+            "status": "ready",
+            "pretrained": "true",
+            "trainable": "false",
+            "finetunable": "false",
+            "model_size": "adaptive",
+            "inference_speed": "adaptive",
+            "accuracy_level": "adaptive",
+            "prompt_types_supported": "point,box",
+            "refinement_supported": "true",
+            "requires_gpu": "false",
+            "input_size": "1024",
         }
     },
 ]
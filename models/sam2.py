@@ -4,19 +4,64 @@ from logging import getLogger
 import numpy as np
 import torch
 import torchvision
+import torch.nn.functional as F
+from torchvision.ops import batched_nms, nms
 from torchvision.transforms.functional import resize
 from iquana_toolbox.schemas.prompts import Prompts
-from transformers import Sam2Model, Sam2Processor
+from transformers import Sam2Config, Sam2Model, Sam2Processor
+from util.hashing import hash_array
 from paths import HUGGINGFACE_TOKEN
 from models.base_models import Prompted2DBaseModel
+from models.embedding_cache import EMBEDDING_CACHE, EmbeddingCache
+from models.embedding_store import EMBEDDING_STORE
+from models.mask_generation import (
+    MaskGenerationConfig,
+    batched_mask_to_box,
+    build_point_grid,
+    calculate_stability_score,
+    generate_crop_boxes,
+    is_box_near_crop_edge,
+)
 
 logger = getLogger(__name__)
 
+DEFAULT_INPUT_SIZE = 1024
+
+
+def scale_input_size(config: Sam2Config, input_size: int):
+    """
+    Adjust the geometry of a SAM2 config to another image encoder input size. The feature map sizes of the
+    backbone and the image embedding size of the prompt encoder scale with the input size. The Hiera positional
+    embeddings are interpolated to the feature map size by the backbone itself, so the pretrained weights still fit.
+    """
+    if input_size % 32 != 0:
+        raise ValueError(f"The encoder input size must be a multiple of 32, got {input_size}.")
+    scale = input_size / config.prompt_encoder_config.image_size
+    config.prompt_encoder_config.image_size = input_size
+    config.vision_config.backbone_feature_sizes = [
+        [int(h * scale), int(w * scale)] for h, w in config.vision_config.backbone_feature_sizes
+    ]
+    backbone_config = getattr(config.vision_config, "backbone_config", None)
+    if backbone_config is not None and hasattr(backbone_config, "image_size"):
+        backbone_config.image_size = [input_size, input_size]
+    return config
+
+
+def scale_processor_input_size(processor: Sam2Processor, input_size: int):
+    """
+    Make the processor resize images and normalize prompt coordinates to another image encoder input size.
+    """
+    processor.image_processor.size = {"height": input_size, "width": input_size}
+    processor.target_size = input_size
+    return processor
+
 
 class SAMPrompted(Prompted2DBaseModel):
-    def __init__(self, model_name_or_path, device='auto'):
+    def __init__(self, model_name_or_path, device='auto', input_size: int = DEFAULT_INPUT_SIZE):
         """
         Initialize the prompted SAM model using Transformers.
+        :param input_size: Size the images are resized to before the image encoder. Smaller sizes trade accuracy
+            for a lower encoder latency, which matters most on CPU.
         """
         super().__init__()
         self.device = device if device != 'auto' else ('cuda' if torch.cuda.is_available() else 'cpu')
@@ -26,15 +71,76 @@ class SAMPrompted(Prompted2DBaseModel):
             model_name_or_path,
             token=HUGGINGFACE_TOKEN,
         )
+        config = Sam2Config.from_pretrained(
+            model_name_or_path,
+            token=HUGGINGFACE_TOKEN,
+        )
+        if input_size != DEFAULT_INPUT_SIZE:
+            scale_input_size(config, input_size)
+            scale_processor_input_size(self.processor, input_size)
         self.model = Sam2Model.from_pretrained(
             model_name_or_path,
+            config=config,
             token=HUGGINGFACE_TOKEN,
         ).to(self.device)
 
+    @property
+    def input_size(self) -> int:
+        return self.processor.image_processor.size["height"]
+
+    @property
+    def version_key(self) -> str:
+        key = f"{type(self).__name__}-{self.model.name_or_path}-{self.input_size}"
+        return key if self.registry_version is None else f"{key}-v{self.registry_version}"
+
+    @property
+    def embedding_cache(self) -> EmbeddingCache:
+        """ In-memory cache of image embeddings, shared by all models within one budget. """
+        return EMBEDDING_CACHE
+
+    def get_image_embeddings(self, image, use_store: bool = True):
+        """
+        Return the image encoder embeddings of the image. They are looked up in the in-memory cache first, then in
+        the persistent embedding store, and only computed if neither has them.
+        :param use_store: Whether to read from and write to the persistent embedding store. Benchmarks disable it
+            to measure the image encoder.
+        """
+        key = hash_array(image)
+        cache_key = (self.version_key, key)
+        embeddings = self.embedding_cache.get(cache_key)
+        if embeddings is not None:
+            return embeddings
+        use_store = use_store and EMBEDDING_STORE is not None
+        if use_store:
+            embeddings = EMBEDDING_STORE.get(self.version_key, key)
+        if embeddings is not None:
+            # Memory-mapped and possibly fp16, moved and converted in one step
+            embeddings = [t.to(self.device, torch.float32) for t in embeddings]
+        else:
+            embeddings = self._encode_image(image)
+            if use_store:
+                EMBEDDING_STORE.put(self.version_key, key, embeddings)
+        self.embedding_cache.put(cache_key, embeddings)
+        return embeddings
+
+    def _encode_image(self, image):
+        """ Run the image encoder on a single image. """
+        inputs = self.processor([image], return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            return list(self.model.get_image_embeddings(inputs["pixel_values"]))
+
     def process_prompted_request(self, image, prompts: Prompts, previous_mask=None):
         """
         Process the image with points or box prompts using the transformers pipeline.
         """
+        final_mask, score, _ = self.predict_with_quality(image, prompts, previous_mask)
+        return [final_mask], [score]
+
+    def predict_with_quality(self, image, prompts: Prompts, previous_mask=None, stability_score_offset: float = 1.0):
+        """
+        Like process_prompted_request, but returns a single mask together with its predicted IoU score and
+        its stability score, computed on the low resolution mask logits.
+        """
         # 1. Prepare Prompts
         point_coords = None # Image x Object x point x coords
         point_labels = None
@@ -52,24 +158,30 @@ class SAMPrompted(Prompted2DBaseModel):
             ymax = int(ymax * image.shape[0])
             box_coords = [[[xmin, ymin, xmax, ymax]]]
 
-        # 2. Pre-process Image and Prompts
-        # The processor handles resizing and normalization
+        # 2. Encode Image and Pre-process Prompts
+        # The image embeddings are cached, repeated clicks on the same image only run the mask decoder.
+        # The processor normalizes the prompt coordinates to the encoder input size.
+        image_embeddings = self.get_image_embeddings(image)
         inputs = self.processor(
-            [image],
             input_points=point_coords,
             input_labels=point_labels,
             input_boxes=box_coords,
+            original_sizes=[list(image.shape[:2])],
             return_tensors="pt"
         ).to(self.device)
         _previous_mask = None
         if previous_mask is not None:
             _previous_mask = torch.from_numpy(previous_mask).unsqueeze(0).unsqueeze(0).to(self.device).float()
-            _previous_mask = resize(_previous_mask, [256, 256])
+            # The mask prompt has the size of the low resolution masks, a quarter of the encoder input size
+            _previous_mask = resize(_previous_mask, [self.input_size // 4, self.input_size // 4])
 
         # 3. Inference
         with torch.no_grad():
             outputs = self.model(
-                **inputs,
+                image_embeddings=image_embeddings,
+                input_points=inputs.get("input_points"),
+                input_labels=inputs.get("input_labels"),
+                input_boxes=inputs.get("input_boxes"),
                 input_masks=_previous_mask,
                 multimask_output=True,
             )
@@ -78,7 +190,7 @@ class SAMPrompted(Prompted2DBaseModel):
         # Convert outputs (low-res masks) to original image size
         batches = self.processor.post_process_masks(
             outputs.pred_masks.cpu(),
-            inputs["original_sizes"].cpu()
+            [list(image.shape[:2])]
         )
 
         # scores: [batch_size, 1, num_masks]
@@ -88,4 +200,118 @@ class SAMPrompted(Prompted2DBaseModel):
         # masks[0] is [1, 3, H, W] -> taking the first batch and usually the highest score mask
         masks = batches[0].squeeze()
         final_mask = masks[best_index].numpy().astype(np.uint8) * 255
-        return [final_mask], [scores[best_index]]
\ No newline at end of file
+        stability = calculate_stability_score(
+            outputs.pred_masks[0, 0, best_index][None].float(), 0.0, stability_score_offset,
+        )
+        return final_mask, scores[best_index], float(stability[0])
+
+    def generate_masks(self, image, config: MaskGenerationConfig = None):
+        """
+        Generate mask proposals for the whole image by prompting the model with a dense grid of points.
+        Every crop is encoded once and the grid points are decoded in batches of config.points_per_batch.
+        Filtering and NMS run on the low resolution mask logits; only the surviving masks are upscaled.
+        Yields tuples of a binary mask (uint8, 0 or 255) in original image size and its predicted IoU score.
+        """
+        config = config or MaskGenerationConfig()
+        im_h, im_w = image.shape[:2]
+        crop_boxes, layer_idxs = generate_crop_boxes((im_h, im_w), config.crop_n_layers, config.crop_overlap_ratio)
+
+        logits, scores, boxes, crops = [], [], [], []
+        for crop_box, layer_idx in zip(crop_boxes, layer_idxs):
+            n_per_side = max(1, config.points_per_side // (config.crop_n_points_downscale_factor ** layer_idx))
+            crop_logits, crop_scores, crop_boxes_xyxy = self._generate_crop_masks(
+                image, crop_box, build_point_grid(n_per_side), config,
+            )
+            logits.append(crop_logits)
+            scores.append(crop_scores)
+            boxes.append(crop_boxes_xyxy)
+            crops.extend([crop_box] * len(crop_scores))
+        logits = torch.cat(logits)
+        scores = torch.cat(scores)
+        boxes = torch.cat(boxes)
+
+        if len(crop_boxes) > 1 and len(scores) > 0:
+            # Remove duplicates between crops, preferring masks from smaller crops
+            crop_areas = torch.tensor([(c[2] - c[0]) * (c[3] - c[1]) for c in crops], dtype=torch.float)
+            keep = nms(boxes, 1 / crop_areas, config.crop_nms_thresh)
+            logits, scores, boxes = logits[keep], scores[keep], boxes[keep]
+            crops = [crops[i] for i in keep.tolist()]
+
+        order = torch.argsort(scores, descending=True)
+        n_masks = 0
+        for i in order.tolist():
+            if config.max_masks is not None and n_masks >= config.max_masks:
+                break
+            x0, y0, x1, y1 = crops[i]
+            crop_mask = F.interpolate(
+                logits[i][None, None].float(), (y1 - y0, x1 - x0), mode="bilinear", align_corners=False,
+            )[0, 0] > config.mask_threshold
+            if int(crop_mask.sum()) < max(config.min_mask_region_area, 1):
+                continue
+            mask = np.zeros((im_h, im_w), dtype=np.uint8)
+            mask[y0:y1, x0:x1] = crop_mask.numpy().astype(np.uint8) * 255
+            n_masks += 1
+            yield mask, float(scores[i])
+
+    def _generate_crop_masks(self, image, crop_box, point_grid, config: MaskGenerationConfig):
+        """
+        Decode a grid of point prompts on one crop of the image.
+        Returns the filtered low resolution mask logits (on CPU, fp16), their predicted IoU scores and
+        their bounding boxes in original image coordinates.
+        """
+        x0, y0, x1, y1 = crop_box
+        crop = image[y0:y1, x0:x1]
+        crop_h, crop_w = crop.shape[:2]
+        points = (point_grid * np.array([[crop_w, crop_h]])).tolist()
+
+        if crop_box == [0, 0, image.shape[1], image.shape[0]]:
+            image_embeddings = self.get_image_embeddings(image)
+        else:
+            image_embeddings = self._encode_image(crop)
+        logits, scores, boxes = [], [], []
+        with torch.no_grad():
+            for start in range(0, len(points), config.points_per_batch):
+                batch_points = points[start:start + config.points_per_batch]
+                prompt_inputs = self.processor(
+                    input_points=[[[p] for p in batch_points]],
+                    input_labels=[[[1] for _ in batch_points]],
+                    original_sizes=[[crop_h, crop_w]],
+                    return_tensors="pt",
+                ).to(self.device)
+                outputs = self.model(
+                    image_embeddings=image_embeddings,
+                    input_points=prompt_inputs["input_points"],
+                    input_labels=prompt_inputs["input_labels"],
+                    multimask_output=True,
+                )
+                # [1, points, masks, h, w] -> [points * masks, h, w]
+                batch_logits = outputs.pred_masks[0].flatten(0, 1)
+                batch_scores = outputs.iou_scores[0].flatten()
+
+                keep = batch_scores >= config.pred_iou_thresh
+                stability = calculate_stability_score(
+                    batch_logits, config.mask_threshold, config.stability_score_offset,
+                )
+                keep &= stability >= config.stability_score_thresh
+                batch_logits, batch_scores = batch_logits[keep], batch_scores[keep]
+
+                # Boxes of the low resolution masks, scaled to original image coordinates
+                low_h, low_w = batch_logits.shape[-2:]
+                batch_boxes = batched_mask_to_box(batch_logits > config.mask_threshold).float()
+                batch_boxes *= torch.tensor(
+                    [crop_w / low_w, crop_h / low_h, crop_w / low_w, crop_h / low_h], device=batch_boxes.device,
+                )
+                batch_boxes += torch.tensor([x0, y0, x0, y0], device=batch_boxes.device)
+                if crop_box != [0, 0, image.shape[1], image.shape[0]]:
+                    keep = ~is_box_near_crop_edge(batch_boxes, crop_box, [0, 0, image.shape[1], image.shape[0]])
+                    batch_logits, batch_scores, batch_boxes = batch_logits[keep], batch_scores[keep], batch_boxes[keep]
+
+                logits.append(batch_logits.half().cpu())
+                scores.append(batch_scores.float().cpu())
+                boxes.append(batch_boxes.cpu())
+
+        logits = torch.cat(logits)
+        scores = torch.cat(scores)
+        boxes = torch.cat(boxes)
+        keep = batched_nms(boxes, scores, torch.zeros_like(scores, dtype=torch.long), config.box_nms_thresh)
+        return logits[keep], scores[keep], boxes[keep]
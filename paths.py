@@ -9,4 +9,31 @@ LOG_DIR = getenv("LOG_DIR", "logs")
 TEMP_DIR = getenv("TEMP_DIR", "temp")
 TEMP_IMAGE_DIR = getenv("TEMP_IMAGE_DIR", "./temp/images")
 MLFLOW_URL = getenv("MLFLOW_URL", "http://localhost:5000")
+# How long a resolved (or failed) lookup of the registry version behind an alias is reused
+REGISTRY_VERSION_TTL_S = float(getenv("REGISTRY_VERSION_TTL_S", 60))
 REDIS_URL = getenv("REDIS_URL", "redis://localhost:6739")
+
+# Embedding cache and prefetching, the in-memory embedding cache is shared by all models
+EMBEDDING_CACHE_MAX_BYTES = int(getenv("EMBEDDING_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+PREFETCH_LOOKAHEAD = int(getenv("PREFETCH_LOOKAHEAD", 3))
+PREFETCH_MIN_FREE_MEMORY_FRACTION = float(getenv("PREFETCH_MIN_FREE_MEMORY_FRACTION", 0.1))
+
+# Capacity
+MAX_CONCURRENT_INFERENCES_PER_MODEL = int(getenv("MAX_CONCURRENT_INFERENCES_PER_MODEL", 1))
+STARTUP_REGISTRATION_ATTEMPTS = int(getenv("STARTUP_REGISTRATION_ATTEMPTS", 5))
+STARTUP_REGISTRATION_BACKOFF_S = float(getenv("STARTUP_REGISTRATION_BACKOFF_S", 2))
+
+# Result cache
+RESULT_CACHE_TTL_S = float(getenv("RESULT_CACHE_TTL_S", 300))
+RESULT_CACHE_MAX_ENTRIES = int(getenv("RESULT_CACHE_MAX_ENTRIES", 256))
+
+# Model cascade of the "auto" registry key. CASCADE_STAGES, CASCADE_MIN_IOU and CASCADE_MIN_STABILITY are read by
+# the cascade on every request, these are the defaults if they are not set
+DEFAULT_CASCADE_STAGES = "sam2-1-tiny,sam2-1-large"
+DEFAULT_CASCADE_MIN_IOU = 0.85
+REQUEST_RECORD_PATH = getenv("REQUEST_RECORD_PATH")
+
+# Persistent embedding store, set EMBEDDING_STORE_MAX_BYTES to 0 to disable it
+EMBEDDING_STORE_DIR = getenv("EMBEDDING_STORE_DIR", os.path.join(TEMP_DIR, "embeddings"))
+EMBEDDING_STORE_MAX_BYTES = int(getenv("EMBEDDING_STORE_MAX_BYTES", 20 * 1024 ** 3))
+EMBEDDING_STORE_FP16 = getenv("EMBEDDING_STORE_FP16", "false").lower() in ("1", "true", "yes")
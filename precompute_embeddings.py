@@ -0,0 +1,85 @@
+"""Precompute the image embeddings of a folder of images into the persistent embedding store.
+
+Run this ahead of an annotation campaign so that the first click on every image only pays the mask decoder. The
+embeddings are stored under EMBEDDING_STORE_DIR, keyed by model version and image content hash. Images that are
+already stored are skipped. Images are loaded like /inference loads them, so pass the image URLs the annotation tool
+will send (one per line in a text file) to be sure the content hashes match.
+
+Usage:
+    python precompute_embeddings.py image_urls.txt --models sam2-1-tiny,sam2-1-large
+    python precompute_embeddings.py path/to/images --models sam2-1-tiny,sam2-1-large
+"""
+import argparse
+import os
+import time
+
+from app.state import get_model
+from models.embedding_store import EMBEDDING_STORE
+from util.hashing import hash_array
+from util.image_loading import load_request_image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+
+
+def find_images(folder: str, recursive: bool) -> list[str]:
+    if not recursive:
+        return sorted(
+            os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(folder)
+        for name in names if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def read_urls(path: str) -> list[str]:
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def precompute(model_registry_key: str, image_paths: list[str]):
+    """ Store the embeddings of the images for one model. The model is loaded like the service loads it, so that the
+    entries are keyed by the same version key the service looks up. """
+    model = get_model(model_registry_key)
+    if not hasattr(model, "embedding_cache"):
+        print(f"Skipping {model_registry_key}, it does not compute image embeddings.")
+        return
+    computed, skipped, failed = 0, 0, 0
+    start = time.perf_counter()
+    for i, path in enumerate(image_paths):
+        try:
+            image = load_request_image(path)
+            if EMBEDDING_STORE.contains(model.version_key, hash_array(image)):
+                skipped += 1
+            else:
+                model.get_image_embeddings(image)
+                computed += 1
+            # Only the persistent store matters here, do not let the in-memory cache grow
+            model.embedding_cache.clear()
+        except Exception as e:
+            failed += 1
+            print(f"\nFailed to process {path}: {e}")
+        print(f"{model_registry_key}: {i + 1}/{len(image_paths)} images", end="\r")
+    EMBEDDING_STORE.flush()
+    print(f"\n{model_registry_key}: computed {computed}, already stored {skipped}, failed {failed} "
+          f"in {time.perf_counter() - start:.1f}s.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", help="Text file with one image URL per line, or a folder with the images.")
+    parser.add_argument("--models", default="sam2-1-tiny", help="Comma separated registry keys.")
+    parser.add_argument("--recursive", action="store_true", help="Include images in subfolders.")
+    args = parser.parse_args()
+
+    if EMBEDDING_STORE is None:
+        raise SystemExit("The embedding store is disabled, set EMBEDDING_STORE_DIR and EMBEDDING_STORE_MAX_BYTES.")
+
+    image_paths = find_images(args.images, args.recursive) if os.path.isdir(args.images) else read_urls(args.images)
+    for model_registry_key in args.models.split(","):
+        precompute(model_registry_key, image_paths)
+
+
+if __name__ == "__main__":
+    main()
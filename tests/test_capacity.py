@@ -0,0 +1,138 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import app.routes
+import util.memory
+from app.capacity import CapacityTracker
+
+
+class Model:
+    """Weak-referenceable stand-in for a loaded model."""
+
+
+class TestCapacityTracker:
+    """Test suite for the readiness and capacity tracking."""
+
+    def test_not_ready_until_startup_complete(self):
+        """Test that readiness fails while startup is running and after a startup error."""
+        tracker = CapacityTracker()
+        assert not tracker.ready
+        tracker.startup_complete.set()
+        assert tracker.ready
+        tracker.startup_error = "registration failed"
+        assert not tracker.ready
+
+    def test_track_records_load_and_latency(self):
+        """Test in-flight counting and latency averaging."""
+        tracker = CapacityTracker(max_concurrency=1)
+        with tracker.track("sam2-1-tiny"):
+            report = tracker.report()
+            assert report["models"]["sam2-1-tiny"]["in_flight"] == 1
+            assert report["in_flight"] == 1
+        report = tracker.report()
+        model_report = report["models"]["sam2-1-tiny"]
+        assert model_report["in_flight"] == 0
+        assert model_report["completed"] == 1
+        assert model_report["avg_latency_s"] is not None
+        assert tracker.estimated_wait_s("sam2-1-tiny") == 0.0
+
+    def test_requests_beyond_concurrency_are_queued(self):
+        """Test that a second request waits in the queue while the only slot is busy."""
+        tracker = CapacityTracker(max_concurrency=1)
+        entered, release = threading.Event(), threading.Event()
+
+        def hold_slot():
+            with tracker.track("sam2-1-tiny"):
+                entered.set()
+                release.wait(timeout=5)
+
+        holder = threading.Thread(target=hold_slot)
+        holder.start()
+        entered.wait(timeout=5)
+
+        def wait_for_slot():
+            with tracker.track("sam2-1-tiny"):
+                pass
+
+        waiter = threading.Thread(target=wait_for_slot)
+        waiter.start()
+        for _ in range(100):
+            if tracker.report()["queue_depth"] == 1:
+                break
+            threading.Event().wait(0.01)
+        assert tracker.report()["queue_depth"] == 1
+        release.set()
+        holder.join(timeout=5)
+        waiter.join(timeout=5)
+        assert tracker.report()["models"]["sam2-1-tiny"]["completed"] == 2
+
+    def test_resident_models_are_weakly_referenced(self):
+        """Test that a model stops being resident once nothing else holds it."""
+        tracker = CapacityTracker()
+        model = Model()
+        tracker.mark_resident("sam2-1-tiny", model)
+        assert tracker.is_resident("sam2-1-tiny")
+        assert tracker.report()["models"]["sam2-1-tiny"]["resident"] is True
+        del model
+        assert not tracker.is_resident("sam2-1-tiny")
+
+
+class TestStartupRegistration:
+    """Test suite for model registration at startup and the resulting health."""
+
+    @pytest.fixture
+    def tracker(self, monkeypatch):
+        tracker = CapacityTracker()
+        monkeypatch.setattr(app, "CAPACITY_TRACKER", tracker)
+        monkeypatch.setattr(app.routes, "CAPACITY_TRACKER", tracker)
+        return tracker
+
+    def test_registration_is_retried(self, tracker, monkeypatch):
+        """Test that a failed registration is retried and the service becomes ready once it succeeds."""
+        calls = []
+
+        def register_models(registry):
+            calls.append(registry)
+            if len(calls) < 3:
+                raise ConnectionError("registry not reachable")
+
+        monkeypatch.setattr(app, "register_models", register_models)
+        app._register_models_in_background(threading.Event(), attempts=5, backoff_s=0.001)
+        assert len(calls) == 3
+        assert tracker.ready
+
+    def test_failed_registration_is_unhealthy(self, tracker, monkeypatch):
+        """Test that /health fails after all registration attempts failed."""
+        def register_models(registry):
+            raise ConnectionError("registry not reachable")
+
+        monkeypatch.setattr(app, "register_models", register_models)
+        client = TestClient(app.create_app())
+        assert client.get("/health").status_code == 200
+
+        app._register_models_in_background(threading.Event(), attempts=2, backoff_s=0.001)
+        assert tracker.startup_failed and not tracker.ready
+        response = client.get("/health")
+        assert response.status_code == 503
+        assert "registry not reachable" in response.json()["startup_error"]
+        assert client.get("/ready").status_code == 503
+
+
+class TestMemoryInfo:
+    """Test suite for the memory headroom reported to the router and used by prefetching."""
+
+    def test_available_memory_includes_page_cache(self, tmp_path, monkeypatch):
+        """Test that free system memory is MemAvailable, not MemFree."""
+        meminfo = tmp_path / "meminfo"
+        meminfo.write_text("MemTotal:       16000000 kB\nMemFree:          500000 kB\nMemAvailable:    8000000 kB\n")
+        monkeypatch.setattr(util.memory, "MEMINFO_PATH", str(meminfo))
+        monkeypatch.setattr(util.memory.torch.cuda, "is_available", lambda: False)
+        assert util.memory.device_memory_info() == (8000000 * 1024, 16000000 * 1024)
+        assert util.memory.free_memory_fraction() == pytest.approx(0.5)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,119 @@
+import json
+import pickle
+
+import pytest
+import numpy as np
+from unittest.mock import Mock
+
+from iquana_toolbox.schemas.prompts import PointPrompt, Prompts
+from app.capacity import CapacityTracker
+from models.cascade import ModelCascade
+from tune_cascade import read_records
+
+
+def stage_model(score, stability):
+    """Create a mock stage model that answers with a fixed score and stability."""
+    model = Mock()
+    model.predict_with_quality = Mock(return_value=(np.ones((8, 8), dtype=np.uint8) * 255, score, stability))
+    return model
+
+
+@pytest.fixture
+def prompts():
+    return Prompts(point_prompts=[PointPrompt(x=0.5, y=0.5, label=1)])
+
+
+class TestModelCascade:
+    """Test suite for the adaptive model cascade."""
+
+    def test_confident_first_stage_answers(self, prompts):
+        """Test that a confident answer of the first stage is not escalated."""
+        models = {"tiny": stage_model(0.95, 0.97), "large": stage_model(0.99, 0.99)}
+        cascade = ModelCascade(stages=["tiny", "large"], min_iou=0.9, min_stability=0.9)
+        cascade.resolve_model = models.__getitem__
+        result = cascade.run(np.zeros((8, 8, 3), dtype=np.uint8), prompts)
+        assert result.model_registry_key == "tiny"
+        assert result.escalations == 0
+        models["large"].predict_with_quality.assert_not_called()
+
+    @pytest.mark.parametrize("score, stability", [(0.7, 0.97), (0.95, 0.5)])
+    def test_low_confidence_escalates(self, prompts, score, stability):
+        """Test that a low IoU score or low stability escalates to the next stage."""
+        models = {"tiny": stage_model(score, stability), "large": stage_model(0.6, 0.6)}
+        cascade = ModelCascade(stages=["tiny", "large"], min_iou=0.9, min_stability=0.9)
+        cascade.resolve_model = models.__getitem__
+        result = cascade.run(np.zeros((8, 8, 3), dtype=np.uint8), prompts)
+        # The last stage always answers, even if it is not confident
+        assert result.model_registry_key == "large"
+        assert result.escalations == 1
+        assert result.score == pytest.approx(0.6)
+
+    def test_stability_check_is_optional(self, prompts):
+        """Test that the stability score is ignored without a stability threshold."""
+        cascade = ModelCascade(stages=["tiny", "large"], min_iou=0.9, min_stability=None)
+        assert cascade.accepts(0.95, 0.1)
+        assert not cascade.accepts(0.85, 1.0)
+
+    def test_pickle_roundtrip_drops_service_hooks(self, prompts):
+        """Test that the cascade can be stored in the registry with the resolver and stage tracking attached."""
+        cascade = ModelCascade(stages=["tiny", "large"], min_iou=0.9)
+        cascade.resolve_model = lambda key: None
+        cascade.resolve_version = lambda key: None
+        cascade.track_stage = lambda key: None
+        restored = pickle.loads(pickle.dumps(cascade))
+        assert restored.thresholds == (["tiny", "large"], 0.9, None)
+        assert restored.resolve_model is None and restored.resolve_version is None and restored.track_stage is None
+        with pytest.raises(RuntimeError):
+            restored.run(np.zeros((8, 8, 3), dtype=np.uint8), prompts)
+
+    def test_thresholds_are_read_from_environment_per_request(self, monkeypatch):
+        """Test that unset stages and thresholds follow the environment without reloading the cascade."""
+        cascade = ModelCascade()
+        monkeypatch.setenv("CASCADE_STAGES", "sam2-1-small,sam2-1-base-plus")
+        monkeypatch.setenv("CASCADE_MIN_IOU", "0.7")
+        monkeypatch.delenv("CASCADE_MIN_STABILITY", raising=False)
+        assert cascade.thresholds == (["sam2-1-small", "sam2-1-base-plus"], 0.7, None)
+        monkeypatch.setenv("CASCADE_MIN_STABILITY", "0.9")
+        assert cascade.thresholds[2] == 0.9
+        assert ModelCascade(min_iou=0.8).thresholds[1] == 0.8
+
+    def test_stage_calls_are_tracked_per_stage_model(self, prompts):
+        """Test that every stage call counts towards the load of the stage model, not the cascade."""
+        models = {"tiny": stage_model(0.5, 0.5), "large": stage_model(0.99, 0.99)}
+        tracker = CapacityTracker()
+        cascade = ModelCascade(stages=["tiny", "large"], min_iou=0.9)
+        cascade.resolve_model = models.__getitem__
+        cascade.track_stage = tracker.track
+        cascade.run(np.zeros((8, 8, 3), dtype=np.uint8), prompts)
+        report = tracker.report()["models"]
+        assert report["tiny"]["completed"] == 1
+        assert report["large"]["completed"] == 1
+        assert "auto" not in report
+
+    def test_version_key_does_not_load_stages(self):
+        """Test that the version key follows the stage registry versions without loading any stage model."""
+        versions = {"tiny": "1", "large": "2"}
+        cascade = ModelCascade(stages=["tiny", "large"], min_iou=0.9)
+        cascade.resolve_model = Mock(side_effect=AssertionError("stage model loaded"))
+        cascade.resolve_version = versions.get
+        key = cascade.version_key
+        assert "tiny@1" in key and "large@2" in key
+        versions["large"] = "3"
+        assert cascade.version_key != key
+        cascade.resolve_model.assert_not_called()
+
+
+class TestReadRecords:
+    """Test suite for reading the recorded requests the cascade is tuned on."""
+
+    def test_skips_corrupted_lines(self, tmp_path, capsys):
+        """Test that a line broken by an interrupted write is skipped instead of aborting the tuning run."""
+        path = tmp_path / "requests.jsonl"
+        path.write_text(json.dumps({"i": 0}) + "\n" + '{"i": 1, "prom' + "\n\n" + json.dumps({"i": 2}) + "\n")
+        assert read_records(path) == [{"i": 0}, {"i": 2}]
+        assert "line 2" in capsys.readouterr().out
+        assert read_records(path, limit=1) == [{"i": 0}]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,89 @@
+import os
+import time
+
+import numpy as np
+import pytest
+import torch
+
+from models.embedding_store import MANIFEST, EmbeddingStore
+
+
+def embeddings(value=1.0):
+    """Create embeddings shaped like a scaled down SAM2 feature pyramid."""
+    return [torch.full((1, 4, 16, 16), value), torch.full((1, 8, 8, 8), value), torch.full((1, 16, 4, 4), value)]
+
+
+class TestEmbeddingStore:
+    """Test suite for the persistent embedding store."""
+
+    def test_roundtrip(self, tmp_path):
+        """Test that stored embeddings are read back unchanged."""
+        store = EmbeddingStore(str(tmp_path), max_bytes=10 * 1024 ** 2)
+        assert store.get("SAMPrompted-facebook/sam2.1-hiera-tiny-1024", "abcdef") is None
+        store.put("SAMPrompted-facebook/sam2.1-hiera-tiny-1024", "abcdef", embeddings(0.5), wait=True)
+        assert store.contains("SAMPrompted-facebook/sam2.1-hiera-tiny-1024", "abcdef")
+        loaded = store.get("SAMPrompted-facebook/sam2.1-hiera-tiny-1024", "abcdef")
+        assert [t.shape for t in loaded] == [t.shape for t in embeddings()]
+        assert all(t.dtype == torch.float32 and torch.all(t == 0.5) for t in loaded)
+        assert store.stats()["hits"] == 1 and store.stats()["misses"] == 1
+
+    def test_fp16_storage(self, tmp_path):
+        """Test that fp16 storage halves the size and loads in the stored dtype without converting."""
+        store = EmbeddingStore(str(tmp_path), max_bytes=10 * 1024 ** 2, fp16=True)
+        store.put("model", "abcdef", embeddings(0.25), wait=True)
+        entry_dir = store._entry_dir("model", "abcdef")
+        size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+        assert size < sum(t.numel() * 4 for t in embeddings())
+        loaded = store.get("model", "abcdef")
+        assert all(t.dtype == torch.float16 and torch.all(t.to("cpu", torch.float32) == 0.25) for t in loaded)
+
+    def test_incomplete_entries_are_misses(self, tmp_path):
+        """Test that an entry missing a level or its manifest is a miss and is replaced by the next write."""
+        store = EmbeddingStore(str(tmp_path), max_bytes=10 * 1024 ** 2)
+        store.put("model", "abcdef", embeddings(), wait=True)
+        entry_dir = store._entry_dir("model", "abcdef")
+        os.remove(os.path.join(entry_dir, "2.npy"))
+        assert store.get("model", "abcdef") is None
+        os.remove(os.path.join(entry_dir, MANIFEST))
+        assert store.get("model", "abcdef") is None
+        assert not store.contains("model", "abcdef")
+
+        store.put("model", "abcdef", embeddings(3.0), wait=True)
+        loaded = store.get("model", "abcdef")
+        assert len(loaded) == 3 and torch.all(loaded[2] == 3.0)
+
+    def test_level_not_matching_manifest_is_miss(self, tmp_path):
+        """Test that a level whose shape differs from the manifest is a miss."""
+        store = EmbeddingStore(str(tmp_path), max_bytes=10 * 1024 ** 2)
+        store.put("model", "abcdef", embeddings(), wait=True)
+        np.save(os.path.join(store._entry_dir("model", "abcdef"), "1.npy"), np.zeros((1, 8, 4, 4), np.float32))
+        assert store.get("model", "abcdef") is None
+
+    def test_duplicate_writes(self, tmp_path):
+        """Test that writing an existing entry again keeps the store consistent."""
+        store = EmbeddingStore(str(tmp_path), max_bytes=10 * 1024 ** 2)
+        store.put("model", "abcdef", embeddings(1.0), wait=True)
+        store._write("model", "abcdef", [t.numpy() for t in embeddings(2.0)])
+        assert torch.all(store.get("model", "abcdef")[0] == 1.0)
+        assert os.listdir(os.path.join(str(tmp_path), ".tmp")) == []
+
+    def test_lru_eviction(self, tmp_path):
+        """Test that the least recently used entries are evicted when the store is full."""
+        entry_bytes = sum(t.numel() * 4 for t in embeddings())
+        store = EmbeddingStore(str(tmp_path), max_bytes=int(entry_bytes * 2.5))
+        store.put("model", "aa0001", embeddings(), wait=True)
+        time.sleep(0.01)
+        store.put("model", "aa0002", embeddings(), wait=True)
+        time.sleep(0.01)
+        assert store.get("model", "aa0001") is not None  # Refreshes the first entry
+        time.sleep(0.01)
+        store.put("model", "aa0003", embeddings(), wait=True)
+        assert store.contains("model", "aa0001")
+        assert not store.contains("model", "aa0002")
+        assert store.contains("model", "aa0003")
+        # Evicted entries are renamed to a tombstone before they are deleted, none are left behind
+        assert os.listdir(os.path.join(str(tmp_path), ".tmp")) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
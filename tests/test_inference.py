@@ -227,6 +227,193 @@ class TestInferenceEndpoint:
             assert response.json()["success"] is True
 
 
+class TestInferenceResultCache:
+    """Test suite for the memoization of identical /inference requests."""
+
+    @pytest.fixture(autouse=True)
+    def clear_result_cache(self):
+        from app.state import RESULT_CACHE
+        RESULT_CACHE.clear()
+        yield
+        RESULT_CACHE.clear()
+
+    @patch("app.routes.inference.get_model")
+    def test_identical_requests_share_one_computation(self, mock_get_model, client, mock_model, point_prompts):
+        """Test that a repeated request is answered from the result cache until the model version changes."""
+        mock_model.version_key = "SAMPrompted-facebook/sam2.1-hiera-tiny-1024-v1"
+        mock_get_model.return_value = mock_model
+        request = {
+            "image_url": "http://example.com/image.jpg",
+            "user_id": "test_user",
+            "model_registry_key": "sam2-1-tiny",
+            "prompts": point_prompts.model_dump(),
+        }
+
+        first = client.post("/inference", json=request)
+        second = client.post("/inference", json=request)
+        assert first.status_code == second.status_code == 200
+        assert first.json() == second.json()
+        mock_model.process_prompted_request.assert_called_once()
+
+        # A new registry version behind the same alias must not be served the cached result
+        mock_model.version_key = "SAMPrompted-facebook/sam2.1-hiera-tiny-1024-v2"
+        assert client.post("/inference", json=request).status_code == 200
+        assert mock_model.process_prompted_request.call_count == 2
+
+
+class TestRequestRecording:
+    """Test suite for recording requests to tune the model cascade."""
+
+    def test_concurrent_records_stay_on_separate_lines(self, tmp_path):
+        """Test that requests recorded from many threads at once each end up as one valid JSON line, also when the
+        file system splits every write."""
+        import builtins
+        import json
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from app.routes.inference import _record_request
+
+        class SplitWrites:
+            def __init__(self, f):
+                self.f = f
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                self.f.close()
+
+            def write(self, data):
+                for start in range(0, len(data), 16):
+                    self.f.write(data[start:start + 16])
+                    self.f.flush()
+                    time.sleep(0.0001)
+
+        path = tmp_path / "requests.jsonl"
+        requests = [Mock(model_dump_json=Mock(return_value=json.dumps({"i": i, "mask": "1" * 64}))) for i in range(16)]
+        with (patch("app.routes.inference.REQUEST_RECORD_PATH", str(path)),
+              patch("app.routes.inference.open", lambda *args: SplitWrites(builtins.open(*args)), create=True),
+              ThreadPoolExecutor(8) as pool):
+            list(pool.map(_record_request, requests))
+        lines = path.read_text().splitlines()
+        assert sorted(json.loads(line)["i"] for line in lines) == list(range(16))
+
+
+class TestGetModel:
+    """Test suite for loading models from the registry."""
+
+    @patch("app.state.get_registry_version", return_value="7")
+    @patch("app.state.MODEL_REGISTRY")
+    def test_registry_version_is_attached(self, mock_registry, mock_get_version):
+        """Test that the registry version is resolved once per loaded model and becomes part of its version key."""
+        from app.state import get_model
+        from models.base_models import Prompted2DBaseModel
+
+        class Model(Prompted2DBaseModel):
+            def process_prompted_request(self, image, prompts, previous_mask=None):
+                return [], []
+
+        model = Model()
+        mock_registry.get_model_by_alias.return_value = model
+        assert get_model("sam2-1-tiny") is model
+        assert get_model("sam2-1-tiny") is model
+        assert model.registry_version == "7"
+        mock_get_version.assert_called_once_with("sam2-1-tiny")
+
+    @patch("app.state._registry_versions", {})
+    @patch("app.state.MLFLOW_CLIENT")
+    def test_failed_registry_version_is_remembered(self, mock_client):
+        """Test that an unreachable registry is asked once, not on every request, until the lookup expires."""
+        from app.state import get_registry_version
+
+        mock_client.get_model_version_by_alias.side_effect = TimeoutError("registry unreachable")
+        assert get_registry_version("sam2-1-tiny") is None
+        assert get_registry_version("sam2-1-tiny") is None
+        mock_client.get_model_version_by_alias.assert_called_once()
+
+        mock_client.get_model_version_by_alias.side_effect = None
+        mock_client.get_model_version_by_alias.return_value = Mock(version=3)
+        with patch("app.state.REGISTRY_VERSION_TTL_S", 0):
+            assert get_registry_version("sam2-1-tiny") == "3"
+
+    @patch("app.state.get_model")
+    def test_preload_loads_model(self, mock_get_model, client):
+        """Test that the preload endpoint loads the model through the service, not the model info route."""
+        response = client.get("/annotation_session/models/sam2-1-tiny/preload", params={"user_id": "test_user"})
+        assert response.status_code == 200
+        mock_get_model.assert_called_once_with("sam2-1-tiny")
+
+
+class TestAutomaticInferenceEndpoint:
+    """Test suite for the /inference/automatic endpoint."""
+
+    @patch("app.routes.inference.load_request_image")
+    @patch("app.routes.inference.get_model")
+    def test_automatic_inference(self, mock_get_model, mock_load_image, client, sample_image):
+        """Test that every generated mask is returned as a contour and the config is passed to the model."""
+        mock_load_image.return_value = sample_image
+        mask = np.zeros((512, 512), dtype=np.uint8)
+        mask[100:200, 100:200] = 255
+        model = Mock()
+        model.generate_masks = Mock(return_value=iter([(mask, 0.98), (mask, 0.91)]))
+        mock_get_model.return_value = model
+
+        response = client.post(
+            "/inference/automatic",
+            json={
+                "image_url": "http://example.com/image.jpg",
+                "user_id": "test_user",
+                "model_registry_key": "sam2-1-tiny",
+                "config": {"points_per_side": 8, "max_masks": 2},
+            }
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["success"] is True
+        assert [contour["confidence"] for contour in data["result"]] == pytest.approx([0.98, 0.91])
+        mock_get_model.assert_called_once_with("sam2-1-tiny")
+        image, config = model.generate_masks.call_args.args
+        assert image is sample_image
+        assert config.points_per_side == 8 and config.max_masks == 2
+
+    @patch("app.routes.inference.get_model")
+    def test_automatic_inference_invalid_config(self, mock_get_model, client):
+        """Test that generation parameters out of bounds are answered with 422 before any model is loaded."""
+        response = client.post(
+            "/inference/automatic",
+            json={
+                "image_url": "http://example.com/image.jpg",
+                "user_id": "test_user",
+                "model_registry_key": "sam2-1-tiny",
+                "config": {"points_per_batch": 0},
+            }
+        )
+
+        assert response.status_code == 422
+        mock_get_model.assert_not_called()
+
+    @patch("app.routes.inference.load_request_image")
+    @patch("app.routes.inference.get_model")
+    def test_automatic_inference_not_supported(self, mock_get_model, mock_load_image, client, sample_image):
+        """Test that models without automatic mask generation are answered with 400."""
+        mock_load_image.return_value = sample_image
+        model = Mock()
+        model.generate_masks.side_effect = NotImplementedError("Automatic mask generation is not supported.")
+        mock_get_model.return_value = model
+
+        response = client.post(
+            "/inference/automatic",
+            json={
+                "image_url": "http://example.com/image.jpg",
+                "user_id": "test_user",
+                "model_registry_key": "auto",
+            }
+        )
+
+        assert response.status_code == 400
+
+
 class TestRegisteredModels:
     """Test that all models in MODEL_REGISTRY_CONFIG are properly defined."""
 
@@ -266,6 +453,7 @@ class TestRegisteredModels:
             "prompt_types_supported",
             "refinement_supported",
             "requires_gpu",
+            "input_size",
         }
         
         for config in MODEL_REGISTRY_CONFIG:
@@ -0,0 +1,87 @@
+import pytest
+import numpy as np
+import torch
+
+from models.mask_generation import (
+    MaskGenerationConfig,
+    batched_mask_to_box,
+    build_point_grid,
+    calculate_stability_score,
+    generate_crop_boxes,
+    is_box_near_crop_edge,
+)
+
+
+class TestMaskGenerationHelpers:
+    """Test suite for the automatic mask generation helpers."""
+
+    def test_point_grid_shape_and_range(self):
+        """Test that the point grid covers the image with n x n points inside [0, 1]."""
+        grid = build_point_grid(4)
+        assert grid.shape == (16, 2)
+        assert np.all(grid > 0) and np.all(grid < 1)
+        np.testing.assert_allclose(grid[0], [0.125, 0.125])
+
+    def test_crop_boxes_per_layer(self):
+        """Test that layer 0 is the full image and layer i has (2**i)**2 crops."""
+        boxes, layers = generate_crop_boxes((600, 800), n_layers=2, overlap_ratio=0.25)
+        assert boxes[0] == [0, 0, 800, 600]
+        assert layers.count(1) == 4
+        assert layers.count(2) == 16
+        for x0, y0, x1, y1 in boxes:
+            assert 0 <= x0 < x1 <= 800
+            assert 0 <= y0 < y1 <= 600
+
+    def test_stability_score(self):
+        """Test that confident logits are stable and borderline logits are not."""
+        logits = torch.zeros(2, 8, 8)
+        logits[0, :4] = 10.0
+        logits[0, 4:] = -10.0
+        logits[1, :4] = 0.5
+        logits[1, 4:] = -10.0
+        scores = calculate_stability_score(logits, mask_threshold=0.0, offset=1.0)
+        assert scores[0] == pytest.approx(1.0)
+        assert scores[1] == pytest.approx(0.0)
+
+    def test_batched_mask_to_box(self):
+        """Test bounding boxes of non-empty and empty masks."""
+        masks = torch.zeros(2, 10, 10, dtype=torch.bool)
+        masks[0, 2:5, 3:7] = True
+        boxes = batched_mask_to_box(masks)
+        assert boxes[0].tolist() == [3, 2, 6, 4]
+        assert boxes[1].tolist() == [0, 0, 0, 0]
+
+    def test_box_near_crop_edge(self):
+        """Test that only boxes cut off by an inner crop border are flagged."""
+        boxes = torch.tensor([[0, 0, 50, 50], [100, 100, 200, 200], [150, 150, 250, 250]], dtype=torch.float)
+        near = is_box_near_crop_edge(boxes, crop_box=[0, 0, 500, 500], orig_box=[0, 0, 1000, 1000])
+        assert near.tolist() == [False, False, False]
+        near = is_box_near_crop_edge(boxes, crop_box=[0, 0, 250, 250], orig_box=[0, 0, 1000, 1000])
+        assert near.tolist() == [False, False, True]
+
+
+
+class TestMaskGenerationConfig:
+    """Test suite for the validation of the generation parameters."""
+
+    @pytest.mark.parametrize("parameters", [
+        {"points_per_batch": 0},
+        {"points_per_side": 0},
+        {"points_per_side": 1000},
+        {"crop_n_layers": 5},
+        {"max_masks": 0},
+        {"box_nms_thresh": 1.5},
+        {"crop_overlap_ratio": 1.0},
+    ])
+    def test_invalid_values_are_rejected(self, parameters):
+        """Test that values that would crash or make the generation unbounded raise a ValueError."""
+        with pytest.raises(ValueError):
+            MaskGenerationConfig(**parameters)
+
+    def test_defaults_are_valid(self):
+        """Test that the defaults pass the validation."""
+        assert MaskGenerationConfig().points_per_side == 32
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from app.memoization import ResultMemoizer, make_request_key
+
+
+class TestResultMemoizer:
+    """Test suite for request coalescing and result memoization."""
+
+    def test_request_key_is_canonical(self):
+        """Test that the key ignores dict ordering but not values."""
+        key = make_request_key("sam2-1-tiny", "v1", "abc", {"x": 0.5, "y": 0.2})
+        assert key == make_request_key("sam2-1-tiny", "v1", "abc", {"y": 0.2, "x": 0.5})
+        assert key != make_request_key("sam2-1-tiny", "v1", "abc", {"x": 0.5, "y": 0.3})
+
+    def test_cached_result_is_reused(self):
+        """Test that a second identical request is a cache hit."""
+        memoizer = ResultMemoizer(ttl_s=60, max_entries=8)
+        calls = []
+        assert memoizer.get_or_compute("key", lambda: calls.append(1) or "result") == "result"
+        assert memoizer.get_or_compute("key", lambda: calls.append(1) or "other") == "result"
+        assert len(calls) == 1
+        stats = memoizer.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 1
+        assert stats["hit_rate"] == pytest.approx(0.5)
+
+    def test_expired_results_are_recomputed(self):
+        """Test that results older than the TTL are not served."""
+        memoizer = ResultMemoizer(ttl_s=0.01, max_entries=8)
+        memoizer.get_or_compute("key", lambda: "first")
+        time.sleep(0.02)
+        assert memoizer.get_or_compute("key", lambda: "second") == "second"
+
+    def test_concurrent_requests_are_coalesced(self):
+        """Test that concurrent identical requests share one computation."""
+        memoizer = ResultMemoizer(ttl_s=0, max_entries=8)
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(timeout=5)
+            return "result"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(memoizer.get_or_compute("key", compute)))
+        leader.start()
+        started.wait(timeout=5)
+        follower = threading.Thread(target=lambda: results.append(memoizer.get_or_compute("key", compute)))
+        follower.start()
+        for _ in range(100):
+            if memoizer.stats()["coalesced"] == 1:
+                break
+            time.sleep(0.01)
+        release.set()
+        leader.join(timeout=5)
+        follower.join(timeout=5)
+        assert results == ["result", "result"]
+        assert len(calls) == 1
+        assert memoizer.stats()["coalesced"] == 1
+
+    def test_failures_are_not_cached(self):
+        """Test that an exception propagates and the next request recomputes."""
+        memoizer = ResultMemoizer(ttl_s=60, max_entries=8)
+
+        def fail():
+            raise RuntimeError("GPU out of memory")
+
+        with pytest.raises(RuntimeError):
+            memoizer.get_or_compute("key", fail)
+        assert memoizer.get_or_compute("key", lambda: "result") == "result"
+
+    def test_max_entries(self):
+        """Test that the least recently used entries are evicted."""
+        memoizer = ResultMemoizer(ttl_s=60, max_entries=2)
+        for key in ["a", "b", "c"]:
+            memoizer.get_or_compute(key, lambda: key)
+        assert memoizer.stats()["entries"] == 2
+        assert memoizer.get_or_compute("a", lambda: "recomputed") == "recomputed"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,188 @@
+import functools
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import pytest
+import numpy as np
+import torch
+from iquana_toolbox.schemas.networking.http.services import PromptedSegmentationRequest
+from iquana_toolbox.schemas.prompts import PointPrompt, Prompts
+
+import app.prefetch
+from app.prefetch import EmbeddingPrefetcher
+from models.embedding_cache import EmbeddingCache
+from util.hashing import hash_array
+
+IMAGE_URLS = [f"http://example.com/image_{i}.jpg" for i in range(6)]
+
+
+def embeddings():
+    """Create embeddings shaped like a scaled down SAM2 feature pyramid."""
+    return [torch.ones(1, 4, 16, 16), torch.ones(1, 8, 8, 8), torch.ones(1, 16, 4, 4)]
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError("Condition not reached in time.")
+        time.sleep(0.01)
+
+
+class RecordingModel:
+    """Stands in for a prompted model: caches embeddings by image content hash and records every encoded image."""
+    def __init__(self):
+        self.embedding_cache = EmbeddingCache(max_bytes=1024 ** 2)
+        self.encoded = []
+
+    def get_image_embeddings(self, image):
+        key = hash_array(image)
+        if key not in self.embedding_cache:
+            self.encoded.append(key)
+            self.embedding_cache.put(key, embeddings())
+        return self.embedding_cache.get(key)
+
+
+@pytest.fixture
+def model():
+    return RecordingModel()
+
+
+@pytest.fixture
+def loaded_urls(monkeypatch):
+    """Replace image loading by an image that encodes its URL, and record the loaded URLs."""
+    urls = []
+
+    def load(image_url):
+        urls.append(image_url)
+        return np.full((8, 8, 3), IMAGE_URLS.index(image_url), dtype=np.uint8)
+
+    monkeypatch.setattr(app.prefetch, "load_request_image", load)
+    return urls
+
+
+@pytest.fixture
+def prefetcher(model):
+    prefetcher = EmbeddingPrefetcher(lambda model_registry_key: model)
+    yield prefetcher
+    prefetcher.shutdown()
+
+
+class TestEmbeddingPrefetcher:
+    """Test suite for the background embedding prefetcher."""
+
+    def test_prefetches_current_and_lookahead_images(self, prefetcher, model, loaded_urls):
+        """Test that the current image and the next lookahead images are encoded in order."""
+        prefetcher.register_session("user", "sam2-1-tiny", IMAGE_URLS, current_index=1, lookahead=2)
+        wait_until(lambda: len(model.encoded) == 3)
+        assert loaded_urls == IMAGE_URLS[1:4]
+        assert prefetcher.pending() == 0
+
+    def test_waits_for_interactive_requests(self, prefetcher, model, loaded_urls):
+        """Test that nothing is prefetched while an interactive request is running."""
+        with prefetcher.interactive():
+            prefetcher.register_session("user", "sam2-1-tiny", IMAGE_URLS, lookahead=1)
+            time.sleep(0.1)
+            assert model.encoded == [] and prefetcher.pending() == 2
+        wait_until(lambda: len(model.encoded) == 2)
+
+    def test_advance_cancels_pending_prefetches(self, prefetcher, model, loaded_urls):
+        """Test that moving on replaces the pending images of the old position."""
+        with prefetcher.interactive():
+            prefetcher.register_session("user", "sam2-1-tiny", IMAGE_URLS, lookahead=2)
+            prefetcher.advance("user", 4)
+            assert prefetcher.pending() == 2
+        wait_until(lambda: len(model.encoded) == 2)
+        assert loaded_urls == IMAGE_URLS[4:6]
+        with pytest.raises(KeyError):
+            prefetcher.advance("unknown user", 1)
+
+    def test_advance_cancels_image_being_loaded(self, prefetcher, model, monkeypatch):
+        """Test that an image whose session moved on while it was loading is not encoded."""
+        loading, release = threading.Event(), threading.Event()
+
+        def slow_load(image_url):
+            if image_url == IMAGE_URLS[0]:
+                loading.set()
+                release.wait(5)
+            return np.full((8, 8, 3), IMAGE_URLS.index(image_url), dtype=np.uint8)
+
+        monkeypatch.setattr(app.prefetch, "load_request_image", slow_load)
+        prefetcher.register_session("user", "sam2-1-tiny", IMAGE_URLS, lookahead=0)
+        assert loading.wait(5)
+        prefetcher.advance("user", 3)
+        release.set()
+        wait_until(lambda: len(model.encoded) == 1)
+        time.sleep(0.1)
+        assert model.encoded == [hash_array(np.full((8, 8, 3), 3, dtype=np.uint8))]
+
+    def test_memory_pressure_drops_pending_prefetches(self, prefetcher, model, loaded_urls, monkeypatch):
+        """Test that all pending prefetches are dropped when free memory is low."""
+        monkeypatch.setattr(app.prefetch, "free_memory_fraction", lambda: 0.01)
+        prefetcher.register_session("user", "sam2-1-tiny", IMAGE_URLS, lookahead=3)
+        wait_until(lambda: prefetcher.pending() == 0)
+        time.sleep(0.1)
+        assert model.encoded == [] and loaded_urls == []
+
+    def test_prefetched_url_is_cache_hit_for_request(self, prefetcher, model, tmp_path):
+        """Test that prefetching an image URL yields the embeddings a request with the same URL looks up."""
+        image = np.random.default_rng(0).integers(0, 255, (64, 80, 3), dtype=np.uint8)
+        cv2.imwrite(str(tmp_path / "image.jpg"), image)
+        handler = functools.partial(SimpleHTTPRequestHandler, directory=str(tmp_path))
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            image_url = f"http://127.0.0.1:{server.server_address[1]}/image.jpg"
+            prefetcher.register_session("user", "sam2-1-tiny", [image_url])
+            wait_until(lambda: len(model.encoded) == 1)
+
+            request = PromptedSegmentationRequest(
+                image_url=image_url,
+                user_id="user",
+                model_registry_key="sam2-1-tiny",
+                prompts=Prompts(point_prompts=[PointPrompt(x=0.5, y=0.5, label=1)]),
+            )
+            model.get_image_embeddings(request.image)
+            assert len(model.encoded) == 1
+        finally:
+            server.shutdown()
+
+
+class TestEmbeddingCache:
+    """Test suite for the in-memory embedding cache."""
+
+    def test_size_bounded_lru(self):
+        """Test that the cache evicts least recently used entries beyond its byte budget."""
+        entry_bytes = sum(t.numel() * 4 for t in embeddings())
+        cache = EmbeddingCache(max_bytes=int(entry_bytes * 2.5))
+        cache.put("a", embeddings())
+        cache.put("b", embeddings())
+        assert cache.get("a") is not None
+        cache.put("c", embeddings())
+        assert "a" in cache and "b" not in cache and "c" in cache
+        assert cache.total_bytes == 2 * entry_bytes
+
+
+class TestHashArray:
+    """Test suite for the content hash used as cache key."""
+
+    def test_equal_content_equal_hash(self):
+        """Test that equal arrays hash equally, also when one is a non-contiguous view."""
+        array = np.arange(24, dtype=np.uint8).reshape(4, 6)
+        assert hash_array(array) == hash_array(array.copy())
+        assert hash_array(array[:, ::2]) == hash_array(np.ascontiguousarray(array[:, ::2]))
+
+    def test_content_shape_and_dtype_change_hash(self):
+        """Test that the hash changes with the content, the shape and the dtype."""
+        array = np.zeros((4, 6), dtype=np.uint8)
+        changed = array.copy()
+        changed[0, 0] = 1
+        assert hash_array(changed) != hash_array(array)
+        assert hash_array(array.reshape(6, 4)) != hash_array(array)
+        assert hash_array(array.astype(np.int8)) != hash_array(array)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,301 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+import numpy as np
+import torch
+from transformers import Sam2Config, Sam2Model, Sam2Processor
+from transformers.models.sam2.image_processing_sam2_fast import Sam2ImageProcessorFast
+
+import models.sam2
+import precompute_embeddings
+from models.embedding_cache import EmbeddingCache
+from models.embedding_store import EmbeddingStore
+from models.mask_generation import MaskGenerationConfig, build_point_grid
+from models.sam2 import SAMPrompted, scale_input_size, scale_processor_input_size
+
+
+class SquareDecoder(torch.nn.Module):
+    """Stands in for Sam2Model: predicts the same square around every point prompt for all three masks."""
+    low_res_size = 256
+    half_size = 16
+    name_or_path = "square-decoder"
+
+    def get_image_embeddings(self, pixel_values):
+        return [torch.zeros(1, 1, 1, 1)]
+
+    def forward(self, image_embeddings, input_points, input_labels, multimask_output=True, **kwargs):
+        # Point coordinates are normalized to the encoder input size, the masks have a quarter of that size
+        points = input_points[0, :, 0] / 4
+        n_points = len(points)
+        half_sizes = self.half_sizes(points)[:, None, None]
+        ys, xs = torch.meshgrid(torch.arange(self.low_res_size), torch.arange(self.low_res_size), indexing="ij")
+        inside = ((xs[None] + 0.5 - points[:, 0, None, None]).abs() <= half_sizes) \
+            & ((ys[None] + 0.5 - points[:, 1, None, None]).abs() <= half_sizes)
+        logits = torch.where(inside, 10.0, -10.0)
+        return SimpleNamespace(
+            pred_masks=logits[None, :, None].expand(1, n_points, 3, -1, -1),
+            iou_scores=self.scores(points)[None],
+        )
+
+    def half_sizes(self, points):
+        return torch.full((len(points),), float(self.half_size))
+
+    def scores(self, points):
+        return torch.tensor([0.9, 0.95, 0.99]).expand(len(points), 3)
+
+
+class TwoSizeDecoder(SquareDecoder):
+    """Predicts small squares with high scores in the left half of the image and large ones in the right half."""
+    def half_sizes(self, points):
+        return torch.where(points[:, 0] < self.low_res_size / 2, 8.0, 16.0)
+
+    def scores(self, points):
+        best = torch.where(points[:, 0] < self.low_res_size / 2, 0.99, 0.95)
+        return torch.stack([torch.full_like(best, 0.9), torch.full_like(best, 0.92), best], dim=1)
+
+
+def make_sam(model, input_size=1024):
+    """Wrap a model in SAMPrompted with a real processor, without loading pretrained weights."""
+    sam = SAMPrompted.__new__(SAMPrompted)
+    torch.nn.Module.__init__(sam)
+    sam.device = "cpu"
+    sam.processor = scale_processor_input_size(Sam2Processor(Sam2ImageProcessorFast()), input_size)
+    sam.model = model
+    return sam
+
+
+@pytest.fixture(autouse=True)
+def embedding_cache(monkeypatch):
+    """Every test starts with an empty in-memory embedding cache, it is shared by all models."""
+    cache = EmbeddingCache(max_bytes=1024 ** 3)
+    monkeypatch.setattr(models.sam2, "EMBEDDING_CACHE", cache)
+    return cache
+
+
+@pytest.fixture
+def sam(monkeypatch):
+    """SAMPrompted with the square decoder."""
+    monkeypatch.setattr(models.sam2, "EMBEDDING_STORE", None)
+    return make_sam(SquareDecoder())
+
+
+@pytest.fixture(scope="module")
+def sam_512():
+    """SAMPrompted with a randomly initialized SAM2 model scaled to a 512 px encoder input size."""
+    torch.manual_seed(0)
+    return make_sam(Sam2Model(scale_input_size(Sam2Config(), 512)).eval(), input_size=512)
+
+
+def centroid(mask):
+    ys, xs = np.nonzero(mask)
+    return xs.mean(), ys.mean()
+
+
+def assert_centroids(masks, expected_centers, atol=2.0):
+    centers = sorted(centroid(mask) for mask in masks)
+    assert len(centers) == len(expected_centers)
+    np.testing.assert_allclose(centers, sorted(expected_centers), atol=atol)
+
+
+class TestGenerateMasks:
+    """Test suite for SAMPrompted.generate_masks."""
+
+    def test_masks_are_placed_at_grid_points(self, sam):
+        """Test that one mask per grid point is returned, located at the point in original image coordinates."""
+        image = np.zeros((200, 300, 3), dtype=np.uint8)
+        results = list(sam.generate_masks(image, MaskGenerationConfig(points_per_side=2)))
+
+        masks = [mask for mask, _ in results]
+        assert all(mask.shape == (200, 300) and mask.dtype == np.uint8 for mask in masks)
+        assert all(set(np.unique(mask)) <= {0, 255} for mask in masks)
+        # The three identical masks of every point are merged by the box NMS, keeping the best score
+        assert [score for _, score in results] == pytest.approx([0.99] * 4)
+        assert_centroids(masks, [tuple(p) for p in build_point_grid(2) * [300, 200]])
+
+    def test_max_masks_and_min_region_area(self, sam):
+        """Test that max_masks limits the number of masks and small masks are discarded."""
+        image = np.zeros((200, 300, 3), dtype=np.uint8)
+        assert len(list(sam.generate_masks(image, MaskGenerationConfig(points_per_side=2, max_masks=3)))) == 3
+        # Every square covers about 33 x 25 pixels of the image
+        config = MaskGenerationConfig(points_per_side=2, min_mask_region_area=1000)
+        assert list(sam.generate_masks(image, config)) == []
+
+    def test_max_masks_counts_masks_after_area_filter(self, monkeypatch):
+        """Test that small masks do not use up max_masks, even if they score best."""
+        monkeypatch.setattr(models.sam2, "EMBEDDING_STORE", None)
+        sam = make_sam(TwoSizeDecoder())
+        image = np.zeros((200, 300, 3), dtype=np.uint8)
+        # The small squares cover about 19 x 13 pixels, the large ones about 38 x 25 pixels
+        config = MaskGenerationConfig(points_per_side=2, min_mask_region_area=500, max_masks=2)
+        results = list(sam.generate_masks(image, config))
+        assert [score for _, score in results] == pytest.approx([0.95, 0.95])
+        assert all(centroid(mask)[0] > 150 for mask, _ in results)
+
+    def test_crop_masks_are_mapped_to_image_coordinates(self, sam):
+        """Test that masks decoded on crops are placed at the crop center in original image coordinates."""
+        image = np.zeros((200, 200, 3), dtype=np.uint8)
+        config = MaskGenerationConfig(points_per_side=1, crop_n_layers=1)
+        masks = [mask for mask, _ in sam.generate_masks(image, config)]
+
+        # The full image and four crops [0, 134] and [66, 200] per side, one point at the center of each
+        assert_centroids(masks, [(100, 100), (67, 67), (67, 133), (133, 67), (133, 133)])
+
+    def test_duplicates_between_crops_are_removed(self, sam, monkeypatch):
+        """Test that identical masks from different crops are merged by the cross-crop NMS."""
+        monkeypatch.setattr(
+            models.sam2, "generate_crop_boxes",
+            lambda *args: ([[0, 0, 200, 200], [50, 50, 150, 150], [50, 50, 150, 150]], [0, 1, 1]),
+        )
+        image = np.zeros((200, 200, 3), dtype=np.uint8)
+        masks = [mask for mask, _ in sam.generate_masks(image, MaskGenerationConfig(points_per_side=1))]
+
+        # The smaller square of the crop overlaps the square of the full image too little to be merged with it
+        assert len(masks) == 2
+        assert_centroids(masks, [(100, 100), (100, 100)])
+
+
+class TestVersionKey:
+    """Test suite for the key that identifies cached embeddings and results of a model."""
+
+    def test_version_key_includes_registry_version(self, sam):
+        """Test that the version key changes with the registry version the model was loaded from."""
+        assert sam.version_key == "SAMPrompted-square-decoder-1024"
+        sam.registry_version = "3"
+        assert sam.version_key == "SAMPrompted-square-decoder-1024-v3"
+
+
+class TestEmbeddingLookup:
+    """Test suite for the lookup of image embeddings in the caches."""
+
+    class Encoder(torch.nn.Module):
+        name_or_path = "encoder"
+
+        def __init__(self):
+            super().__init__()
+            self.calls = 0
+
+        def get_image_embeddings(self, pixel_values):
+            self.calls += 1
+            return [torch.full((1, 4, 16, 16), 0.5), torch.full((1, 8, 8, 8), 0.5)]
+
+    def test_stored_embeddings_are_converted_to_float32(self, tmp_path, monkeypatch):
+        """Test that fp16 embeddings from the persistent store are used as float32 without re-encoding."""
+        store = EmbeddingStore(str(tmp_path), max_bytes=10 * 1024 ** 2, fp16=True)
+        monkeypatch.setattr(models.sam2, "EMBEDDING_STORE", store)
+        sam = make_sam(self.Encoder())
+        image = np.zeros((32, 32, 3), dtype=np.uint8)
+        sam.get_image_embeddings(image)
+        store.flush()
+        sam.embedding_cache.clear()
+
+        embeddings = sam.get_image_embeddings(image)
+        assert sam.model.calls == 1
+        assert all(t.dtype == torch.float32 and torch.all(t == 0.5) for t in embeddings)
+
+    def test_store_can_be_bypassed(self, tmp_path, monkeypatch):
+        """Test that use_store=False neither reads from nor writes to the persistent store."""
+        store = EmbeddingStore(str(tmp_path), max_bytes=10 * 1024 ** 2)
+        monkeypatch.setattr(models.sam2, "EMBEDDING_STORE", store)
+        sam = make_sam(self.Encoder())
+        image = np.zeros((32, 32, 3), dtype=np.uint8)
+        sam.get_image_embeddings(image)
+        store.flush()
+        sam.embedding_cache.clear()
+
+        sam.get_image_embeddings(image, use_store=False)
+        assert sam.model.calls == 2
+        assert store.stats()["hits"] == 0 and store.stats()["misses"] == 1
+
+    def test_models_share_one_cache_budget(self, monkeypatch):
+        """Test that all models cache into one bounded cache, without hitting each other's entries."""
+        entry_bytes = (4 * 16 * 16 + 8 * 8 * 8) * 4
+        cache = EmbeddingCache(max_bytes=int(entry_bytes * 1.5))
+        monkeypatch.setattr(models.sam2, "EMBEDDING_STORE", None)
+        monkeypatch.setattr(models.sam2, "EMBEDDING_CACHE", cache)
+        first, second = make_sam(self.Encoder()), make_sam(self.Encoder())
+        first.registry_version, second.registry_version = "1", "2"
+        image = np.zeros((32, 32, 3), dtype=np.uint8)
+
+        first.get_image_embeddings(image)
+        second.get_image_embeddings(image)
+        assert first.model.calls == 1 and second.model.calls == 1
+        # The budget only fits one entry, the entry of the second model evicted the one of the first
+        assert len(cache) == 1 and cache.total_bytes == entry_bytes
+        first.get_image_embeddings(image)
+        assert first.model.calls == 2
+
+    @patch("app.state.get_registry_version", return_value="4")
+    @patch("app.state.MODEL_REGISTRY")
+    def test_precomputed_embeddings_are_hits_for_service(self, mock_registry, mock_get_version, tmp_path, monkeypatch):
+        """Test that embeddings precomputed by the CLI are found by a model the service loads later."""
+        store = EmbeddingStore(str(tmp_path / "store"), max_bytes=10 * 1024 ** 2)
+        monkeypatch.setattr(models.sam2, "EMBEDDING_STORE", store)
+        monkeypatch.setattr(precompute_embeddings, "EMBEDDING_STORE", store)
+        image = np.zeros((32, 32, 3), dtype=np.uint8)
+        monkeypatch.setattr(precompute_embeddings, "load_request_image", lambda path: image)
+        mock_registry.get_model_by_alias.side_effect = lambda key, alias: make_sam(self.Encoder())
+
+        precompute_embeddings.precompute("sam2-1-tiny", ["image.png"])
+        from app.state import get_model
+        sam = get_model("sam2-1-tiny")
+        assert sam.version_key.endswith("-v4")
+        sam.get_image_embeddings(image)
+        assert sam.model.calls == 0 and store.stats()["hits"] == 1
+
+
+class TestInputSize:
+    """Test suite for reduced image encoder input sizes."""
+
+    def test_scaled_model_geometry(self, sam_512, monkeypatch):
+        """Test that a 512 px model produces embeddings and masks of a quarter of the 1024 px sizes."""
+        monkeypatch.setattr(models.sam2, "EMBEDDING_STORE", None)
+        image = np.random.default_rng(0).integers(0, 255, (300, 400, 3), dtype=np.uint8)
+        embeddings = sam_512.get_image_embeddings(image)
+        assert [tuple(e.shape) for e in embeddings] == [(1, 32, 128, 128), (1, 64, 64, 64), (1, 256, 32, 32)]
+
+        inputs = sam_512.processor(
+            input_points=[[[[100, 150]]]], input_labels=[[[1]]], original_sizes=[[300, 400]], return_tensors="pt",
+        )
+        with torch.no_grad():
+            outputs = sam_512.model(
+                image_embeddings=embeddings,
+                input_points=inputs["input_points"],
+                input_labels=inputs["input_labels"],
+                multimask_output=True,
+            )
+        assert tuple(outputs.pred_masks.shape) == (1, 1, 3, 128, 128)
+        assert tuple(outputs.iou_scores.shape) == (1, 1, 3)
+
+    def test_prompted_request_with_previous_mask(self, sam_512, monkeypatch):
+        """Test that masks are returned in original image size and a previous mask is accepted."""
+        monkeypatch.setattr(models.sam2, "EMBEDDING_STORE", None)
+        image = np.random.default_rng(1).integers(0, 255, (300, 400, 3), dtype=np.uint8)
+        prompts = SimpleNamespace(
+            point_prompts=[SimpleNamespace(x=0.25, y=0.5, label=1)],
+            box_prompt=SimpleNamespace(xyxy=(0.1, 0.1, 0.6, 0.9)),
+        )
+        mask, score, stability = sam_512.predict_with_quality(
+            image, prompts, previous_mask=np.zeros((300, 400), dtype=np.uint8),
+        )
+        assert mask.shape == (300, 400) and mask.dtype == np.uint8
+        assert 0.0 <= stability <= 1.0
+        assert sam_512.input_size == 512
+        assert sam_512.version_key.endswith("-512")
+
+    def test_processor_resizes_to_input_size(self):
+        """Test that the processor resizes images to the scaled input size."""
+        processor = scale_processor_input_size(Sam2Processor(Sam2ImageProcessorFast()), 768)
+        inputs = processor([np.zeros((300, 400, 3), dtype=np.uint8)], return_tensors="pt")
+        assert tuple(inputs["pixel_values"].shape) == (1, 3, 768, 768)
+        assert processor.target_size == 768
+
+    @pytest.mark.parametrize("input_size", [500, 1000, 100])
+    def test_input_size_must_be_multiple_of_32(self, input_size):
+        """Test that input sizes the backbone cannot tile are rejected."""
+        with pytest.raises(ValueError):
+            scale_input_size(Sam2Config(), input_size)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
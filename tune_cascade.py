@@ -0,0 +1,121 @@
+"""Tune the thresholds of the "auto" model cascade against recorded requests.
+
+Requests are recorded by the service when REQUEST_RECORD_PATH is set. Every recorded request is run on every stage
+of the cascade. The answer of the last stage serves as the reference. The script then simulates the cascade on a
+grid of thresholds and reports, for each setting, the agreement with the reference, the escalation rate and the
+expected latency. It recommends the fastest setting whose mean IoU with the reference reaches --target-iou.
+
+Usage:
+    python tune_cascade.py requests.jsonl --stages sam2-1-tiny,sam2-1-large --target-iou 0.95
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from iquana_toolbox.mlflow import MLFlowModelRegistry
+from iquana_toolbox.schemas.networking.http.services import PromptedSegmentationRequest
+
+from models.cascade import ModelCascade
+from paths import MLFLOW_URL
+
+
+def mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    a, b = a > 0, b > 0
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def read_records(path, limit=None):
+    """Read up to limit recorded requests, skipping lines that are not valid JSON, e.g. from an interrupted write."""
+    records = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if limit is not None and len(records) >= limit:
+                break
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_number} of {path}, it is not valid JSON: {e}")
+    return records
+
+
+def run_stages(records, stages, registry):
+    """Run every record on every stage. Returns per record a list of (score, stability, mask, latency_s)."""
+    models = {key: registry.get_model_by_alias(key, "latest") for key in stages}
+    results = []
+    for i, record in enumerate(records):
+        request = PromptedSegmentationRequest(**record)
+        image = request.image
+        previous_mask = request.previous_mask.mask if request.previous_mask else None
+        stage_results = []
+        for key in stages:
+            model = models[key]
+            # Measure the first click on an image, including the image encoder but not the persistent store
+            model.embedding_cache.clear()
+            start = time.perf_counter()
+            model.get_image_embeddings(image, use_store=False)
+            mask, score, stability = model.predict_with_quality(image, request.prompts, previous_mask)
+            stage_results.append((float(score), stability, mask, time.perf_counter() - start))
+        results.append(stage_results)
+        print(f"Processed {i + 1}/{len(records)} requests", end="\r")
+    print()
+    return results
+
+
+def simulate(results, min_iou, min_stability):
+    """Simulate the cascade. Returns the mean IoU with the reference, escalation rate and mean latency."""
+    ious, escalated, latencies = [], 0, []
+    for stage_results in results:
+        reference = stage_results[-1][2]
+        latency = 0.0
+        for i, (score, stability, mask, stage_latency) in enumerate(stage_results):
+            latency += stage_latency
+            is_last = i == len(stage_results) - 1
+            stable = min_stability is None or stability >= min_stability
+            if is_last or (score >= min_iou and stable):
+                ious.append(mask_iou(mask, reference))
+                escalated += i > 0
+                break
+        latencies.append(latency)
+    return float(np.mean(ious)), escalated / len(results), float(np.mean(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("records", help="JSONL file with recorded PromptedSegmentationRequests.")
+    parser.add_argument("--stages", default=",".join(ModelCascade().thresholds[0]), help="Comma separated registry keys.")
+    parser.add_argument("--target-iou", type=float, default=0.95,
+                        help="Minimum mean IoU of the cascade answers with the answers of the last stage.")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N records.")
+    args = parser.parse_args()
+
+    records = read_records(args.records, args.limit)
+    stages = args.stages.split(",")
+    results = run_stages(records, stages, MLFlowModelRegistry(MLFLOW_URL))
+
+    print(f"{'min_iou':>8} {'min_stab':>8} {'mean_iou':>9} {'escalated':>9} {'latency_s':>9}")
+    candidates = []
+    for min_iou in np.arange(0.50, 1.00, 0.02):
+        for min_stability in [None, 0.80, 0.85, 0.90, 0.95]:
+            mean_iou, escalation_rate, latency = simulate(results, min_iou, min_stability)
+            candidates.append((latency, min_iou, min_stability, mean_iou, escalation_rate))
+            print(f"{min_iou:8.2f} {str(min_stability):>8} {mean_iou:9.3f} {escalation_rate:9.1%} {latency:9.3f}")
+
+    always_last = float(np.mean([sum(r[3] for r in stage_results) for stage_results in results]))
+    print(f"\nRunning only {stages[-1]}: {np.mean([r[-1][3] for r in results]):.3f}s, "
+          f"running all stages: {always_last:.3f}s per request.")
+    feasible = [c for c in candidates if c[3] >= args.target_iou]
+    if not feasible:
+        print(f"No threshold reaches a mean IoU of {args.target_iou}, keep using {stages[-1]}.")
+        return
+    latency, min_iou, min_stability, mean_iou, escalation_rate = min(feasible, key=lambda c: c[0])
+    print(f"Recommended: CASCADE_MIN_IOU={min_iou:.2f}"
+          + (f" CASCADE_MIN_STABILITY={min_stability:.2f}" if min_stability is not None else "")
+          + f" (mean IoU {mean_iou:.3f}, {escalation_rate:.1%} escalated, {latency:.3f}s per request)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+import hashlib
+
+import numpy as np
+
+
+def hash_array(array: np.ndarray) -> str:
+    """Return a content hash of a numpy array, including its shape and dtype."""
+    array = np.ascontiguousarray(array)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((array.shape, array.dtype.str)).encode())
+    digest.update(memoryview(array).cast("B"))
+    return digest.hexdigest()
@@ -1,6 +1,9 @@
+from urllib.request import urlopen
+
 import cv2
 import numpy as np
 from fastapi import UploadFile
+from iquana_toolbox.schemas.networking.http.services import PromptedSegmentationRequest
 
 
 def load_image_from_upload(upload: UploadFile):
@@ -8,3 +11,23 @@ def load_image_from_upload(upload: UploadFile):
     image_data = upload.file.read()
     image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
     return image
+
+
+def load_image_from_url(image_url: str):
+    """Load an image from a http(s) URL or a local file path and return it as an RGB numpy array."""
+    if image_url.startswith(("http://", "https://")):
+        with urlopen(image_url) as response:
+            image_data = response.read()
+    else:
+        with open(image_url, "rb") as f:
+            image_data = f.read()
+    image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"Could not decode image from {image_url}.")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def load_request_image(image_url: str):
+    """Load an image exactly like PromptedSegmentationRequest.image does for /inference. Images loaded ahead of a
+    request must go through the same decoding, otherwise their content hashes and thus the cached embeddings differ."""
+    return PromptedSegmentationRequest.model_construct(image_url=image_url).image
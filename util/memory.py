@@ -0,0 +1,38 @@
+import os
+
+import torch
+
+MEMINFO_PATH = "/proc/meminfo"
+
+
+def _system_memory_info() -> tuple[int, int] | None:
+    """Return (available_bytes, total_bytes) of the system memory. MemAvailable includes page cache the kernel can
+    reclaim, MemFree (SC_AVPHYS_PAGES) does not and is only used where /proc/meminfo is missing."""
+    try:
+        with open(MEMINFO_PATH) as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["MemAvailable"].split()[0]) * 1024, int(fields["MemTotal"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        pass
+    try:
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        return os.sysconf("SC_AVPHYS_PAGES") * page_size, os.sysconf("SC_PHYS_PAGES") * page_size
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def device_memory_info() -> tuple[int, int] | None:
+    """Return (free_bytes, total_bytes) of the device the models run on, or None if it cannot be determined.
+    On CPU, free means available: free memory plus page cache that the kernel can reclaim."""
+    if torch.cuda.is_available():
+        return torch.cuda.mem_get_info()
+    return _system_memory_info()
+
+
+def free_memory_fraction() -> float:
+    """Fraction of free memory on the device the models run on. Returns 1.0 if it cannot be determined."""
+    info = device_memory_info()
+    if info is None:
+        return 1.0
+    free, total = info
+    return free / total